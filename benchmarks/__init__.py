@@ -0,0 +1,4 @@
+"""
+Benchmarks of smartXML: scenarios over deterministic synthetic documents, one per operation or feature,
+and a comparison with the standard library parsers (python -m benchmarks).
+"""
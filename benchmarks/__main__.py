@@ -0,0 +1,61 @@
+"""
+Run the benchmark suite, compare its results to a baseline, or compare smartXML to the standard library parsers.
+
+Usage:
+    python -m benchmarks run [--sizes small medium] [--documents wide deep] [--scenarios parse find] [--output results.json]
+    python -m benchmarks compare baseline.json results.json [--threshold 0.25]
+    python -m benchmarks stdlib [--sizes small] [--documents wide deep] [--output stdlib_results.json]
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from .generators import GENERATORS, SIZES
+from .stdlib import run_comparison
+from .suite import SCENARIOS, compare, read_results, run_suite, write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the scenarios and write the results as JSON")
+    run_parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["small", "medium"])
+    run_parser.add_argument("--documents", nargs="+", choices=GENERATORS)
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS)
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+
+    compare_parser = commands.add_parser("compare", help="compare results to a baseline, fail on regressions")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("results", type=Path)
+    compare_parser.add_argument("--threshold", type=float, default=0.25, help="relative slowdown, e.g. 0.25 is 25%%")
+
+    stdlib_parser = commands.add_parser("stdlib", help="run the same workloads on ElementTree and minidom")
+    stdlib_parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["small"])
+    stdlib_parser.add_argument("--documents", nargs="+", choices=GENERATORS)
+    stdlib_parser.add_argument("--repeats", type=int, default=3)
+    stdlib_parser.add_argument("--seed", type=int, default=1)
+    stdlib_parser.add_argument("--output", type=Path, default=Path("stdlib_results.json"))
+
+    args = parser.parse_args()
+    if args.command == "run":
+        results = run_suite(args.sizes, args.documents, args.scenarios, args.repeats, args.seed)
+        write_results(results, args.output)
+        print(f"results written to {args.output}")
+    elif args.command == "stdlib":
+        results = run_comparison(args.sizes, args.documents, args.repeats, args.seed)
+        write_results(results, args.output)
+        print(f"results written to {args.output}")
+    else:
+        regressions = compare(read_results(args.baseline), read_results(args.results), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions")
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Deterministic synthetic XML documents for the benchmarks.
+Each generator gets an approximate number of elements and a seed, and returns the same text for the same arguments.
+All documents have <section> elements with <item> sons, each item has a <value>, and the value of the last item
+is "needle", so the same searches can run on all of them.
+"""
+
+import random
+
+SIZES = {"small": 1_000, "medium": 10_000, "large": 100_000}
+
+_WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "kappa", "lambda", "sigma"]
+
+
+def _words(rnd: random.Random, count: int) -> str:
+    return " ".join(rnd.choice(_WORDS) for _ in range(count))
+
+
+def _document(rnd: random.Random, size: int, items_per_section: int, item) -> str:
+    """Sections of items, item(rnd, index, value) returns the text of a single item."""
+    item_count = max(1, size // 3)  # an item and its value, plus its share of sections and extra elements
+    parts = ["<root>\n"]
+    for index in range(item_count):
+        if index % items_per_section == 0:
+            if index:
+                parts.append("</section>\n")
+            parts.append(f'<section id="s{index // items_per_section}">\n')
+        value = "needle" if index == item_count - 1 else str(rnd.randint(0, 1_000_000))
+        parts.append(item(rnd, index, value))
+    parts.append("</section>\n</root>\n")
+    return "".join(parts)
+
+
+def wide(size: int, seed: int = 1) -> str:
+    """A single section with all the items."""
+    rnd = random.Random(seed)
+    return _document(rnd, size, size, lambda rnd, index, value: f"<item><value>{value}</value><flag/></item>\n")
+
+
+def deep(size: int, seed: int = 1) -> str:
+    """Items nested in chains of 100 levels."""
+    rnd = random.Random(seed)
+    depth = 100
+
+    def item(rnd: random.Random, index: int, value: str) -> str:
+        closing = "</item>" * depth + "\n" if index % depth == depth - 1 else ""
+        return f"<item><value>{value}</value>\n{closing}"
+
+    text = _document(rnd, size, depth, item)
+    item_count = max(1, size // 3)
+    unclosed = item_count % depth
+    if unclosed:  # close the last chain
+        text = text.replace("</section>\n</root>", "</item>" * unclosed + "\n</section>\n</root>")
+    return text
+
+
+def attribute_heavy(size: int, seed: int = 1) -> str:
+    """Items with ten attributes each."""
+    rnd = random.Random(seed)
+
+    def item(rnd: random.Random, index: int, value: str) -> str:
+        attributes = " ".join(f'{word}{number}="{rnd.randint(0, 1000)}"' for number, word in enumerate(_WORDS))
+        return f'<item id="i{index}" {attributes}><value unit="cm" scale="{rnd.random():.3f}">{value}</value></item>\n'
+
+    return _document(rnd, size, 100, item)
+
+
+def comment_heavy(size: int, seed: int = 1) -> str:
+    """Text comments and commented out elements between the items."""
+    rnd = random.Random(seed)
+
+    def item(rnd: random.Random, index: int, value: str) -> str:
+        comment = f"<!-- {_words(rnd, 5)} -->" if index % 2 else f"<!-- <old><value>{index}</value></old> -->"
+        return f"{comment}\n<item><value>{value}</value></item>\n"
+
+    return _document(rnd, size, 100, item)
+
+
+def cdata_heavy(size: int, seed: int = 1) -> str:
+    """Items with a CDATA section of (escaped like) markup."""
+    rnd = random.Random(seed)
+
+    def item(rnd: random.Random, index: int, value: str) -> str:
+        data = f"<p>{_words(rnd, 8)}</p> & {rnd.randint(0, 1000)} < {rnd.randint(0, 1000)}"
+        return f"<item><value>{value}</value><data><![CDATA[{data}]]></data></item>\n"
+
+    return _document(rnd, size, 100, item)
+
+
+def multi_line(size: int, seed: int = 1) -> str:
+    """Items with a few lines of text."""
+    rnd = random.Random(seed)
+
+    def item(rnd: random.Random, index: int, value: str) -> str:
+        lines = "\n".join(_words(rnd, 6) for _ in range(rnd.randint(2, 5)))
+        return f"<item><value>{value}</value><text>\n{lines}\n</text></item>\n"
+
+    return _document(rnd, size, 100, item)
+
+
+def mixed(size: int, seed: int = 1) -> str:
+    """Text, nested elements, comments and CDATA mixed together, in sections of random sizes."""
+    rnd = random.Random(seed)
+
+    def item(rnd: random.Random, index: int, value: str) -> str:
+        kind = rnd.randint(0, 4)
+        if kind == 0:
+            extra = f"{_words(rnd, 3)}\n<b>{_words(rnd, 2)}</b>\n{_words(rnd, 3)}"
+        elif kind == 1:
+            extra = f"<!-- {_words(rnd, 4)} -->"
+        elif kind == 2:
+            extra = f"<![CDATA[{_words(rnd, 4)}]]>"
+        elif kind == 3:
+            extra = f'<group kind="{rnd.choice(_WORDS)}"><b>{_words(rnd, 2)}</b><i/></group>'
+        else:
+            extra = "<empty/>"
+        return f'<item n="{index}"><value>{value}</value>{extra}</item>\n'
+
+    return _document(rnd, size, rnd.randint(20, 200), item)
+
+
+GENERATORS = {
+    "wide": wide,
+    "deep": deep,
+    "attribute_heavy": attribute_heavy,
+    "comment_heavy": comment_heavy,
+    "cdata_heavy": cdata_heavy,
+    "multi_line": multi_line,
+    "mixed": mixed,
+}
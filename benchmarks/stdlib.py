@@ -0,0 +1,171 @@
+"""
+The same parse, search, edit and serialize workloads on smartXML, xml.etree.ElementTree and xml.dom.minidom,
+over the synthetic documents, reporting throughput and peak memory.
+"""
+
+import statistics
+import time
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+from xml.dom import minidom
+
+from smartXML.element import Element
+from smartXML.xmltree import SmartXML
+
+from .generators import GENERATORS, SIZES
+
+
+class SmartXMLWorkload:
+    name = "smartXML"
+
+    @staticmethod
+    def parse(text: str):
+        xml = SmartXML(find_cache_size=0)
+        xml._read_xml(text)
+        return xml
+
+    @staticmethod
+    def search(xml: SmartXML):
+        xml.find("item", only_one=False)
+        xml.find("value", with_content="needle")
+
+    @staticmethod
+    def edit(xml: SmartXML):
+        items = xml.find("item", only_one=False)
+        for item in items[::10]:
+            item.name = "entry"
+        for item in items[1::10]:
+            item.remove()
+        for item in items[2::10]:
+            Element("added").add_after(item)
+
+    @staticmethod
+    def serialize(xml: SmartXML) -> str:
+        return xml.to_string()
+
+
+class ElementTreeWorkload:
+    name = "ElementTree"
+
+    @staticmethod
+    def parse(text: str):
+        return ElementTree.fromstring(text)
+
+    @staticmethod
+    def search(root):
+        list(root.iter("item"))
+        next((value for value in root.iter("value") if value.text == "needle"), None)
+
+    @staticmethod
+    def edit(root):
+        parents = {son: parent for parent in root.iter() for son in parent}  # no parent links in ElementTree
+        items = list(root.iter("item"))
+        for item in items[::10]:
+            item.tag = "entry"
+        for item in items[1::10]:
+            parents[item].remove(item)
+        for item in items[2::10]:
+            parent = parents[item]
+            parent.insert(list(parent).index(item) + 1, ElementTree.Element("added"))
+
+    @staticmethod
+    def serialize(root) -> str:
+        return ElementTree.tostring(root, encoding="unicode")
+
+
+class MinidomWorkload:
+    name = "minidom"
+
+    @staticmethod
+    def parse(text: str):
+        return minidom.parseString(text)
+
+    @staticmethod
+    def search(document):
+        document.getElementsByTagName("item")
+        next(
+            (
+                value
+                for value in document.getElementsByTagName("value")
+                if value.firstChild is not None and value.firstChild.data == "needle"
+            ),
+            None,
+        )
+
+    @staticmethod
+    def edit(document):
+        items = document.getElementsByTagName("item")
+        for item in items[::10]:
+            item.tagName = item.nodeName = "entry"
+        for item in items[1::10]:
+            item.parentNode.removeChild(item)
+        for item in items[2::10]:
+            item.parentNode.insertBefore(document.createElement("added"), item.nextSibling)
+
+    @staticmethod
+    def serialize(document) -> str:
+        return document.toxml()
+
+
+WORKLOADS = [SmartXMLWorkload, ElementTreeWorkload, MinidomWorkload]
+
+
+def _best_time(function, argument, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _peak_memory(text: str, workload) -> tuple[int, int]:
+    """:return: the peak memory while parsing, and the memory the parsed tree keeps, in bytes"""
+    tracemalloc.start()
+    try:
+        tree = workload.parse(text)
+        kept, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del tree
+    return peak, kept
+
+
+def run_comparison(sizes: list[str], documents: list[str] = None, repeats: int = 3, seed: int = 1) -> dict:
+    """
+    Run the workloads of all the libraries on the generated documents
+    :return: the results, as written to the JSON file
+    """
+    results = []
+    for size in sizes:
+        for document in documents or GENERATORS:
+            text = GENERATORS[document](SIZES[size], seed)
+            megabytes = len(text.encode()) / 1_000_000
+            for workload in WORKLOADS:
+                parse_time = _best_time(workload.parse, text, repeats)
+                search_time = _best_time(workload.search, workload.parse(text), repeats)
+                edit_times = [_best_time(workload.edit, workload.parse(text), 1) for _ in range(repeats)]
+                serialize_time = _best_time(workload.serialize, workload.parse(text), repeats)
+                peak, kept = _peak_memory(text, workload)
+                result = {
+                    "library": workload.name,
+                    "document": document,
+                    "size": size,
+                    "megabytes": megabytes,
+                    "parse_mb_per_second": megabytes / parse_time,
+                    "searches_per_second": 1 / search_time,
+                    "edits_per_second": 1 / statistics.median(edit_times),
+                    "serialize_mb_per_second": megabytes / serialize_time,
+                    "parse_peak_mb": peak / 1_000_000,
+                    "tree_mb": kept / 1_000_000,
+                }
+                results.append(result)
+                print(
+                    f"{document:16} {size:8} {workload.name:12}"
+                    f" parse {result['parse_mb_per_second']:7.2f} MB/s"
+                    f"  search {result['searches_per_second']:9.1f}/s"
+                    f"  edit {result['edits_per_second']:9.1f}/s"
+                    f"  serialize {result['serialize_mb_per_second']:7.2f} MB/s"
+                    f"  peak {result['parse_peak_mb']:8.2f} MB  tree {result['tree_mb']:8.2f} MB"
+                )
+    return {"seed": seed, "repeats": repeats, "results": results}
@@ -0,0 +1,371 @@
+"""
+Parse, find, mutate and write scenarios over the synthetic documents, with JSON results,
+and a comparison of results against a stored baseline.
+Scenarios that time an option or an alternative API (e.g. find_summaries, mutate_batch) are meant
+to be compared with their plain counterpart (find, mutate) on the same document and size.
+Besides the times, each result has the garbage collector pauses of the timed runs, and the memory
+a run allocates and keeps (the tree a parse builds, the memos a search leaves), measured by tracemalloc.
+"""
+
+import copy
+import gc
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from smartXML.element import Element
+from smartXML.xmltree import SmartXML
+
+from .generators import GENERATORS, SIZES
+
+
+def _read(text: str, **options) -> SmartXML:
+    xml = SmartXML(find_cache_size=0, **options)  # repeated searches should traverse the tree, not hit the cache
+    xml._read_xml(text)
+    return xml
+
+
+def _parse_with(**options):
+    def scenario(text: str):
+        def run():
+            return _read(text, **options)
+
+        return None, run
+
+    return scenario
+
+
+_FIND_QUERIES = {
+    "items": {"name": "item", "only_one": False},
+    "values": {"name": "section|item|value", "only_one": False},
+    "missing": "missing",
+    "needle": {"with_content": "needle"},
+}
+
+
+def _find_with(**options):
+    def scenario(text: str):
+        xml = _read(text, **options)
+
+        def run():
+            for query in _FIND_QUERIES.values():
+                xml.find(query) if isinstance(query, str) else xml.find(**query)
+
+        return None, run
+
+    return scenario
+
+
+def _find_many(text: str):
+    xml = _read(text)
+
+    def run():
+        xml.find_many(_FIND_QUERIES)  # the queries of find, in a single traversal
+
+    return None, run
+
+
+def _queries(count: int) -> dict:
+    """Queries of find_many() for the scaling scenarios, most of them traverse the whole tree."""
+    rnd = random.Random(count)
+    queries = {}
+    for index in range(count):
+        kind = index % 3
+        if kind == 0:
+            queries[f"q{index}"] = {"name": "item|value", "with_content": str(rnd.randint(0, 1_000_000))}
+        elif kind == 1:
+            queries[f"q{index}"] = f"missing{rnd.randint(0, 1000)}"
+        else:
+            queries[f"q{index}"] = {"name": "value", "only_one": False}
+    return queries
+
+
+def _find_queries(count: int):
+    def scenario(text: str):
+        xml = _read(text)
+        queries = _queries(count)
+
+        def run():
+            for query in queries.values():
+                xml.find(query) if isinstance(query, str) else xml.find(**query)
+
+        return None, run
+
+    return scenario
+
+
+def _find_many_queries(count: int):
+    def scenario(text: str):
+        xml = _read(text)
+        queries = _queries(count)
+
+        def run():
+            xml.find_many(queries)
+
+        return None, run
+
+    return scenario
+
+
+def _find_content(text: str):
+    xml = _read(text)
+
+    def run():
+        xml.find("value", with_content="needle")  # the contents are memoized after the first run
+        xml.find(with_content="needle")
+
+    return None, run
+
+
+def _read_items(text: str):
+    def prepare():
+        xml = _read(text)
+        return xml, xml.find("item", only_one=False)
+
+    return prepare
+
+
+def _edit(items: list[Element]):
+    for item in items[::10]:
+        item.name = "entry"
+    for item in items[1::10]:
+        item.remove()
+    for item in items[2::10]:
+        Element("added").add_after(item)
+    for item in items[3::10]:
+        item.content = "changed"
+
+
+def _mutate(text: str):
+    def run(prepared):
+        _edit(prepared[1])
+
+    return _read_items(text), run
+
+
+def _mutate_batch(text: str):
+    def run(prepared):
+        xml, items = prepared
+        with xml.batch():
+            _edit(items)
+
+    return _read_items(text), run
+
+
+def _bulk_sons(text: str):
+    def prepare():
+        xml = _read(text)
+        return xml.find("section", only_one=False)
+
+    def run(sections):
+        for section in sections:
+            removed = section.remove_sons(lambda son: son.name == "item")
+            section.extend_sons(removed)
+
+    return prepare, run
+
+
+def _attributes(text: str):
+    def run(prepared):
+        return [item.attributes for item in prepared[1]]  # parsed from the raw tag text on first access
+
+    return _read_items(text), run
+
+
+def _content(text: str):
+    def run(prepared):
+        return [item.content for item in prepared[1]]
+
+    return _read_items(text), run
+
+
+def _comment_out(text: str):
+    def prepare():
+        return _read(text).find("item|value", only_one=False)
+
+    def run(values):
+        for value in values:
+            value.comment_out()
+        for value in values:
+            value.uncomment()
+
+    return prepare, run
+
+
+def _clone(text: str):
+    xml = _read(text)
+
+    def run():
+        return xml.tree.clone()
+
+    return None, run
+
+
+def _deepcopy(text: str):
+    tree = _read(text).tree.clone()  # deepcopy follows the links to the parent and the document, copy a detached tree
+
+    def run():
+        return copy.deepcopy(tree)
+
+    return None, run
+
+
+def _write(text: str):
+    xml = _read(text)
+
+    def run():
+        xml.to_string()
+
+    return None, run
+
+
+SCENARIOS = {
+    "parse": _parse_with(),
+    "parse_pause_gc": _parse_with(pause_gc=True),
+    "parse_reference_source": _parse_with(reference_source=True),
+    "parse_summaries": _parse_with(name_summaries=True),
+    "find": _find_with(),
+    "find_summaries": _find_with(name_summaries=True),
+    "find_many": _find_many,
+    "find_10_queries": _find_queries(10),
+    "find_many_10_queries": _find_many_queries(10),
+    "find_50_queries": _find_queries(50),
+    "find_many_50_queries": _find_many_queries(50),
+    "find_200_queries": _find_queries(200),
+    "find_many_200_queries": _find_many_queries(200),
+    "find_content": _find_content,
+    "attributes": _attributes,
+    "content": _content,
+    "mutate": _mutate,
+    "mutate_batch": _mutate_batch,
+    "bulk_sons": _bulk_sons,
+    "comment_out": _comment_out,
+    "clone": _clone,
+    "deepcopy": _deepcopy,
+    "write": _write,
+}
+
+
+class _GCPauses:
+    """A gc.callbacks callback, that sums the pauses of the collections."""
+
+    def __init__(self):
+        self.collections = 0
+        self.seconds = 0.0
+        self._start = 0.0
+
+    def __call__(self, phase: str, info: dict):
+        if phase == "start":
+            self._start = time.perf_counter()
+        else:
+            self.collections += 1
+            self.seconds += time.perf_counter() - self._start
+
+
+def _measure(prepare, run, repeats: int) -> tuple[list[float], list[_GCPauses]]:
+    """Time the runs, and the garbage collector pauses in each."""
+    times = []
+    pauses = []
+    for _ in range(repeats):
+        prepared = prepare() if prepare is not None else None
+        run_pauses = _GCPauses()
+        gc.callbacks.append(run_pauses)
+        try:
+            start = time.perf_counter()
+            result = run() if prepare is None else run(prepared)
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.callbacks.remove(run_pauses)
+        pauses.append(run_pauses)
+        del result
+    return times, pauses
+
+
+def _measure_memory(prepare, run) -> tuple[int, int]:
+    """
+    Trace an extra, untimed, run.
+    :return: the bytes it allocated and still kept at its end, its result included, and its peak
+    """
+    prepared = prepare() if prepare is not None else None
+    kept = []
+    tracemalloc.start()
+    try:
+        kept.append(run() if prepare is None else run(prepared))
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return retained, peak
+
+
+def run_suite(
+    sizes: list[str], documents: list[str] = None, scenarios: list[str] = None, repeats: int = 5, seed: int = 1
+) -> dict:
+    """
+    Run the scenarios on the generated documents
+    :param sizes: names of SIZES to run
+    :param documents: names of GENERATORS to run, all if None
+    :param scenarios: names of SCENARIOS to run, all if None
+    :param repeats: how many times each scenario is timed, min and median are reported,
+            with the median number of collections and collector pause of the runs
+    :param seed: seed of the generators
+    :return: the results, as written to the JSON file
+    """
+    results = []
+    for size in sizes:
+        for document in documents or GENERATORS:
+            text = GENERATORS[document](SIZES[size], seed)
+            for scenario in scenarios or SCENARIOS:
+                prepare, run = SCENARIOS[scenario](text)
+                times, pauses = _measure(prepare, run, repeats)
+                retained, peak = _measure_memory(prepare, run)
+                result = {
+                    "document": document,
+                    "size": size,
+                    "scenario": scenario,
+                    "characters": len(text),
+                    "min": min(times),
+                    "median": statistics.median(times),
+                    "gc_collections": statistics.median(pause.collections for pause in pauses),
+                    "gc_pause": statistics.median(pause.seconds for pause in pauses),
+                    "retained_bytes": retained,
+                    "peak_bytes": peak,
+                }
+                results.append(result)
+                print(
+                    f"{document:16} {size:8} {scenario:22} {result['min']:10.4f}s  gc {result['gc_pause']:8.4f}s"
+                    f"  retained {retained / 1e6:8.2f}MB  peak {peak / 1e6:8.2f}MB"
+                )
+    return {"python": platform.python_version(), "seed": seed, "repeats": repeats, "results": results}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.25) -> list[str]:
+    """
+    Compare results to a baseline, by the min time of each (document, size, scenario) in both
+    :param threshold: relative slowdown that counts as a regression, e.g. 0.25 is 25% slower
+    :return: descriptions of the regressions
+    """
+    baseline_times = {(result["document"], result["size"], result["scenario"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["document"], result["size"], result["scenario"])
+        if key not in baseline_times:
+            continue
+        ratio = result["min"] / baseline_times[key]["min"]
+        line = f"{key[0]:16} {key[1]:8} {key[2]:22} {baseline_times[key]['min']:10.4f}s -> {result['min']:10.4f}s"
+        if ratio > 1 + threshold:
+            line += f"  REGRESSION x{ratio:.2f}"
+            regressions.append(line)
+        print(line)
+    return regressions
+
+
+def write_results(results: dict, file_name: Path):
+    file_name.write_text(json.dumps(results, indent=2))
+
+
+def read_results(file_name: Path) -> dict:
+    return json.loads(file_name.read_text())
@@ -0,0 +1,3 @@
+from .xmltree import find_in_file
+
+__all__ = ["find_in_file"]
@@ -1,18 +1,96 @@
 from __future__ import annotations
 
-from typing import Union
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, Iterable, Union
 
 import warnings
 import re
 
 
+_ATTRIBUTE_RE = re.compile(r'([^\s=]+)\s*=\s*"([^"]*)"')
+_WRITTEN_ATTRIBUTES_RE = re.compile(r'(?: [^\s="]+="[^"]*")*')  # attributes, as they are written by _to_string()
+_WRITTEN_ATTRIBUTE_NAME_RE = re.compile(r' ([^\s="]+)=')
+_WRITE_CHECK_INTERVAL = 512  # elements written between calls of the check given to _write()
+
+
+def _is_written_as_is(raw_attributes: str) -> bool:
+    """Whether attributes, as read, are already written as _to_string() would write their dict."""
+    if not _WRITTEN_ATTRIBUTES_RE.fullmatch(raw_attributes):
+        return False
+    if raw_attributes.count('="') < 2:
+        return True
+    names = _WRITTEN_ATTRIBUTE_NAME_RE.findall(raw_attributes)
+    return len(set(names)) == len(names)  # a repeated name is written once, with its last value
+
+
 class IllegalOperation(Exception):
     def __init__(self, message: str):
         self.message = message
         super().__init__(self.message)
 
 
+class EventType(Enum):
+    insert = 1
+    remove = 2
+    rename = 3
+    content_change = 4
+    attribute_change = 5
+    comment_out = 6
+    uncomment = 7
+
+
+class Event:
+    """A change of the XML tree, as passed to the callbacks of SmartXML.subscribe()."""
+
+    def __init__(self, event_type: EventType, element: "ElementBase", parent: "ElementBase" = None, old=None, new=None):
+        self.event_type = event_type
+        self.element = element  # the inserted, removed or changed element
+        self.parent = parent  # for insert and remove, the parent the element was inserted to or removed from
+        self.old = old  # for rename, content_change and attribute_change, the value before and after the change
+        self.new = new
+
+    def __repr__(self):
+        return f"{self.event_type.name}: {self.element!r}"
+
+
+@lru_cache(maxsize=4096)
+def _name_bit(name: str) -> int:
+    """A single bit representing the name in the (bloom filter like) subtree names summary."""
+    if not name:
+        return 0
+    return 1 << (hash(name.casefold()) & 63)
+
+
+class StructureEpoch:
+    """
+    A state of the structure of a document, it stops being current when an element is moved or commented out.
+    The path memos use a state of the names too, that stops being current on renames as well.
+    """
+
+    __slots__ = ("current",)
+
+    def __init__(self):
+        self.current = True
+
+
 class ElementBase:
+    _owner = None  # the SmartXML document the element belongs to, kept on every element, see _set_owner()
+    _summary = None  # bits of all the names in the subtree, see _name_bit(), None if not maintained
+    _pre = 0  # document order numbering, maintained by SmartXML, valid only with the document's order stamp
+    _post = 0
+    _order_stamp = None
+    _position_epoch = None  # _depth and _in_comment are valid while this StructureEpoch of their document is current
+    _depth = 0
+    _path_epoch = None  # _path is valid while this StructureEpoch of its document is current, see get_path()
+    _path = None
+    _content = None  # content memo, reset whenever a ContentOnly son is added, removed or changed
+    _comments_below = 0  # number of comments among the descendants
+    _in_comment = False  # whether any ancestor is a comment
+    _batches = []  # the active batches, of all the documents, see SmartXML.batch()
+    _observed = 0  # number of documents with subscribers, see SmartXML.subscribe()
+    _is_empty = False  # whether the element is self-closing, only an Element read as <name/> may be
+
     def __init__(self, name: str):
         self._name = name
         self._sons = []
@@ -21,23 +99,22 @@ class ElementBase:
     @property
     def content(self) -> str:
         """Get the content of the element."""
-        the_content = ""
-        for son in self._sons:
-            if isinstance(son, ContentOnly):
-                the_content += son._text + "\n"
-        return the_content.rstrip("\n")
+        if self._content is None:
+            self._content = "\n".join(son._text for son in self._sons if isinstance(son, ContentOnly)).rstrip("\n")
+        return self._content
 
     @content.setter
     def content(self, new_content: str):
         """Set the content of the element."""
-        if len(self._sons) == 0:
-            self._sons.append(ContentOnly(new_content))
+        self._save_state()
+        if len(self._sons) > 0 and isinstance(self._sons[0], ContentOnly):
+            self._sons[0]._set_first_line(new_content)
         else:
-            first_son = self._sons[0]
-            if isinstance(first_son, ContentOnly):
-                first_son.text = new_content
-            else:
-                self._sons.insert(0, ContentOnly(new_content))
+            content_only = ContentOnly(new_content)
+            content_only._parent = self
+            content_only._owner = self._owner
+            self._sons.insert(0, content_only)
+            self._sons_added([content_only])
 
     @property
     def parent(self):
@@ -56,7 +133,14 @@ class ElementBase:
         if not bool(_XML_NAME_RE.match(new_name)):
             raise ValueError(f"Invalid tag name '{new_name}'")
 
+        self._save_state()
+        old_name = self._name
         self._name = new_name
+        self._names_changed()
+        self._add_name_to_summaries()
+        self._mark_modified()
+        if ElementBase._observed:
+            self._notify(Event(EventType.rename, self, old=old_name, new=new_name))
 
     def __repr__(self):
         return f"{self.name}"
@@ -79,31 +163,320 @@ class ElementBase:
     def _to_string(self, index: int, indentation: str) -> str:
         pass
 
+    def _write_parts(self, index: int, indentation: str) -> str | tuple[str, list["ElementBase"], int, str]:
+        """
+        The text of this element, or, for an element whose sons are written on their own lines,
+        the text before the sons, the sons, their indentation index, and the text after them.
+        Lets _write() go over deep trees without recursion.
+        """
+        return self._to_string(index, indentation)
+
+    def _write(self, index: int, indentation: str, check: Callable[[], None] = None) -> str:
+        """
+        Convert this element and all its descendants to a string, without recursion.
+        :param check: if given, called every _WRITE_CHECK_INTERVAL elements, e.g. to stop a cancelled write
+        """
+        parts = []
+        stack = [(self, index)]
+        countdown = _WRITE_CHECK_INTERVAL
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+            if check is not None:
+                countdown -= 1
+                if not countdown:
+                    check()
+                    countdown = _WRITE_CHECK_INTERVAL
+            element, element_index = item
+            written = element._write_parts(element_index, indentation)
+            if isinstance(written, str):
+                parts.append(written)
+                continue
+            before, sons, sons_index, after = written
+            parts.append(before)
+            stack.append(after)
+            stack.extend((son, sons_index) for son in reversed(sons))
+        return "".join(parts)
+
+    def _document(self):
+        """Get the SmartXML document this element belongs to, or None if it is not a part of one."""
+        return self._owner
+
+    def _set_owner(self, document):
+        """
+        Set the document of this element and of all its descendants, after it was moved into or out of a tree.
+        Keeping the document on every element lets each change find it without walking up to the root.
+        """
+        stack = [self]
+        while stack:
+            element = stack.pop()
+            element._owner = document
+            stack.extend(element._sons)
+
+    def _find_owner(self):
+        """Find the document of this element by walking up to the root, for when the kept ones can not be trusted."""
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        document = root._owner
+        if document is not None and document._tree is root:
+            return document
+        return None
+
+    def _active_batch(self) -> "Batch | None":
+        """Get the batch that records the changes of this element: the one of its document, if any."""
+        if not ElementBase._batches:
+            return None
+        document = self._owner
+        if document is not None:
+            return document._batch
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        for batch in ElementBase._batches:
+            if id(root) in batch._saved:  # taken out of the document of the batch, inside the batch
+                return batch
+        return None
+
+    def _save_state(self, owner: "ElementBase" = None):
+        """
+        Let the active batch save the state of this element, before it is changed.
+        :param owner: the element whose batch saves the state, e.g. the new parent of an element that is inserted
+        """
+        if ElementBase._batches:
+            batch = (owner or self)._active_batch()
+            if batch is not None:
+                batch.save(self)
+
+    def _notify(self, event: Event):
+        """Pass the event to the subscribers of the document this element belongs to."""
+        document = self._document()
+        if document is None or not document._subscribers:
+            return
+        if document._batch is not None:
+            document._batch.events.append((document, event))  # passed on only if the batch is not rolled back
+        else:
+            document._notify(event)
+
+    def _structure_changed(self):
+        """Outdate the depth memos of the document this element belongs to, after elements were moved or commented out."""
+        document = self._document()
+        if document is not None:
+            document._structure_changed()
+
+    def _names_changed(self):
+        """Outdate the path memos of the document this element belongs to, after a rename."""
+        document = self._document()
+        if document is not None:
+            document._names_changed()
+
+    def _leave_document(self):
+        """Outdate the document whose root this element is, before it is inserted into another tree."""
+        if self._parent is None:
+            self._structure_changed()
+            self._mark_modified()
+
+    def _mark_modified(self):
+        """Bump the modification counter of the document this element belongs to."""
+        document = self._document()
+        if document is not None and document._batch is None:  # otherwise, bumped once when the batch ends
+            document._version += 1
+
+    def _add_to_comments_below(self, count: int):
+        if self._active_batch() is not None:
+            return  # recounted when the batch ends
+        element = self
+        while element is not None:
+            element._comments_below += count
+            element = element._parent
+
+    def _sons_added(self, sons: list["ElementBase"]):
+        """Update the derived data (caches, summaries, counters), after the sons were added to this element."""
+        if self._is_empty:
+            self._is_empty = False
+        self._content = None
+        self._structure_changed()
+        if self._active_batch() is None:  # otherwise, reconciled when the batch ends
+            comments = 0
+            for son in sons:
+                comments += son._comments_below + son.is_comment()
+                self._add_summary_to_ancestors(son)
+            if comments:
+                self._add_to_comments_below(comments)
+            self._mark_modified()
+        if ElementBase._observed:
+            for son in sons:
+                self._notify(Event(EventType.insert, son, parent=self))
+
+    def _sons_removed(self, sons: list["ElementBase"]):
+        """Update the derived data (caches, summaries, counters), after the sons were removed from this element."""
+        self._content = None
+        self._structure_changed()
+        if self._active_batch() is None:  # otherwise, reconciled when the batch ends
+            comments = sum(son._comments_below + son.is_comment() for son in sons)
+            if comments:
+                self._add_to_comments_below(-comments)
+            self._outdate_summary()
+            self._mark_modified()
+        if ElementBase._observed:
+            for son in sons:
+                self._notify(Event(EventType.remove, son, parent=self))
+
     def _remove_from_parent(self):
         parent = self._parent
         if parent is not None:
+            parent._save_state()
+            self._save_state()
             index = self._parent._sons.index(self)
             del self._parent._sons[index]
+            self._parent = None
+            parent._sons_removed([self])
+
+    def _update_position(self):
+        """
+        Bring the depth, and whether inside a comment, of this element and its ancestors up to date.
+        The memos are kept only for elements of a document, and are valid while its structure epoch is current.
+        """
+        epoch = self._position_epoch
+        if epoch is not None and epoch.current:
+            return
+
+        outdated = []
+        element = self
+        while element is not None and (element._position_epoch is None or not element._position_epoch.current):
+            outdated.append(element)
+            element = element._parent
+
+        if element is not None:
+            epoch = element._position_epoch
+        else:
+            document = outdated[-1]._document()
+            epoch = document._structure_epoch if document is not None else None
+
+        for element in reversed(outdated):
+            parent = element._parent
+            if parent is not None:
+                element._depth = parent._depth + 1
+                element._in_comment = parent._in_comment or parent.is_comment()
+            else:
+                element._depth = 0
+                element._in_comment = False
+            element._position_epoch = epoch
 
     def get_path(self) -> str:
         """Get the full path of the element
         returns: the path as a string from the root of the XML tree, separated by |.
         """
-        elements = []
-        current = self
-        while current is not None:
-            elements.append(current._name)
-            current = current._parent
-        return "|".join(reversed(elements))
+        epoch = self._path_epoch
+        if epoch is not None and epoch.current:
+            return self._path
+
+        names = []
+        top = element = self
+        while element is not None and (element._path_epoch is None or not element._path_epoch.current):
+            names.append(element._name)
+            top = element
+            element = element._parent
+        names.reverse()
+
+        if element is not None:
+            epoch = element._path_epoch
+            prefix = element._path + "|"
+        else:
+            document = top._document()
+            epoch = document._path_epoch if document is not None else None
+            prefix = ""
+        if epoch is None:  # detached elements are not memoized
+            return prefix + "|".join(names)
+
+        # the memos are kept for this element and its parent only, which is the prefix of all its sons' paths,
+        # memoizing all the ancestors would keep a string per ancestor, growing with the square of the depth
+        if len(names) > 1:
+            parent = self._parent
+            parent._path = prefix + "|".join(names[:-1])
+            parent._path_epoch = epoch
+            prefix = parent._path + "|"
+            names = names[-1:]
+        self._path = prefix + names[0]
+        self._path_epoch = epoch
+        return self._path
+
+    def get_depth(self) -> int:
+        """Get the depth of the element
+        returns: the number of ancestors of the element, 0 for the root of the XML tree.
+        """
+        self._update_position()
+        return self._depth
+
+    def _build_summary(self):
+        """Build the names summary of this element and all its descendants."""
+        for element in reversed(list(self._iter_tree())):  # sons before their parents
+            summary = _name_bit(element._name_for_match())
+            for son in element._sons:
+                summary |= son._summary
+            element._summary = summary
+
+    def _outdate_summary(self):
+        """
+        Let the names summary of this element keep the names of removed sons, until the next search of its document
+        recalculates it, so removing many sons rescans the remaining ones once, not on every removal.
+        """
+        if self._summary is not None and self._owner is not None:
+            self._owner._outdated_summaries[id(self)] = self
+
+    def _refresh_summary(self):
+        """Recalculate the names summary of this element and its ancestors, after removals."""
+        element = self
+        while element is not None and element._summary is not None:
+            summary = _name_bit(element._name_for_match())
+            for son in element._sons:
+                if son._summary is None:
+                    son._build_summary()
+                summary |= son._summary
+            if summary == element._summary and element is not self:
+                break
+            element._summary = summary
+            element = element._parent
+
+    def _add_summary_to_ancestors(self, son: "ElementBase"):
+        """Add the names of a newly inserted son to the summaries of this element and its ancestors."""
+        if self._summary is None:
+            return
+        if son._summary is None:
+            son._build_summary()
+        self._add_to_summaries(son._summary)
+
+    def _add_name_to_summaries(self):
+        """Add the new name of this element to its summary and to its ancestors', after a rename."""
+        if self._summary is not None and self._active_batch() is None:  # otherwise, reconciled when the batch ends
+            self._add_to_summaries(_name_bit(self._name_for_match()))
+
+    def _add_to_summaries(self, bits: int):
+        """
+        Add name bits to the summaries of this element and its ancestors, up to the first that already has them.
+        The bit of a name that is gone (renamed) is kept until a removal outdates the summary,
+        a summary with extra bits only makes a search visit a subtree it could skip.
+        """
+        element = self
+        while element is not None and element._summary is not None:
+            if element._summary | bits == element._summary:
+                break
+            element._summary |= bits
+            element = element._parent
 
     def _insert_into_parent_at_index(self, new_parent: "ElementBase", index: int):
-        if new_parent._is_empty:
-            new_parent._is_empty = False
-
+        self._leave_document()
         self._remove_from_parent()
 
+        new_parent._save_state()
+        self._save_state(new_parent)
         self._parent = new_parent
+        if self._owner is not new_parent._owner:
+            self._set_owner(new_parent._owner)
         new_parent._sons.insert(index, self)
+        new_parent._sons_added([self])
 
     def add_before(self, sibling: "ElementBase"):
         """Add this element before the given sibling element."""
@@ -128,12 +501,48 @@ class ElementBase:
             category=DeprecationWarning,
             stacklevel=2,
         )
+        self._save_state()
+        son._save_state()
+        son._save_state(self)
+        son._leave_document()
         self._sons.append(son)
         son._parent = self
+        if son._owner is not self._owner:
+            son._set_owner(self._owner)
+        self._sons_added([son])
+
+    def _copy(self) -> "ElementBase":
+        """A copy of this element alone, without sons, parent or any cached data."""
+        element = self.__class__.__new__(self.__class__)
+        element._name = self._name
+        element._sons = []
+        element._parent = None
+        return element
+
+    def clone(self) -> "ElementBase":
+        """Create a deep copy of this element and all its descendants, that is not a part of any XML tree.
+        Strings (names, texts and attribute values) are shared with the original elements.
+        """
+        root = self._copy()
+        root._comments_below = self._comments_below
+        stack = [(self, root)]
+        while stack:
+            original, copy = stack.pop()
+            sons = copy._sons
+            for son in original._sons:
+                son_copy = son._copy()
+                son_copy._parent = copy
+                son_copy._comments_below = son._comments_below
+                sons.append(son_copy)
+                if son._sons:
+                    stack.append((son, son_copy))
+        return root
 
     def remove(self):
         """Remove this element from its parent's sons."""
         self._remove_from_parent()
+        if self._owner is not None:
+            self._set_owner(None)
 
     def _get_index_in_parent(self) -> int:
         index = 0
@@ -179,23 +588,29 @@ class ElementBase:
         else:
             return self._parent
 
+    def _name_for_match(self) -> str:
+        return self._name
+
     def _check_name_match(self, names: str, case_sensitive: bool) -> bool:
         if names:
             if case_sensitive:
-                if self.name != names:
+                if self._name_for_match() != names:
                     return False
             else:
-                if self.name.casefold() != names.casefold():
+                if self._name_for_match().casefold() != names.casefold():
                     return False
         return True
 
     def _check_content_match(self, with_content: str, case_sensitive: bool) -> bool:
         if with_content is None:
             return True
+        content = self._content
+        if content is None:
+            content = self.content
         if case_sensitive:
-            if self.content == with_content:
+            if content == with_content:
                 return True
-        elif self.content.casefold() == with_content.casefold():
+        elif content.casefold() == with_content.casefold():
             return True
 
         return False
@@ -214,37 +629,48 @@ class ElementBase:
                             return found
         return None
 
-    def _find_one(self, names: str, with_content: str, case_sensitive: bool) -> ElementBase | None:
+    def _iter_tree(self, names_bits: int = 0):
+        """Iterate over this element and all its descendants, in document order.
+        :param names_bits: if given, skip subtrees whose names summary has none of these bits
+        """
+        if names_bits and self._active_batch() is not None:
+            names_bits = 0  # summaries are not maintained inside a batch
+        if names_bits and self._owner is not None and self._owner._outdated_summaries:
+            self._owner._refresh_summaries()
+        stack = [self]
+        while stack:
+            element = stack.pop()
+            yield element
+            if names_bits:
+                for son in reversed(element._sons):
+                    summary = son._summary
+                    if summary is None or summary & names_bits:
+                        stack.append(son)
+            else:
+                stack.extend(reversed(element._sons))
 
+    def _find_one_here(
+        self, names: str, names_list: list[str], with_content: str, case_sensitive: bool
+    ) -> ElementBase | None:
         if self._check_name_match(names, case_sensitive):
             if self._check_content_match(with_content, case_sensitive):
                 return self
 
-        names_list = names.split("|")
-
         if len(names_list) > 1:
             if self._check_name_match(names_list[0], case_sensitive):
                 found = self._find_one_in_sons(names_list[1:], with_content, case_sensitive)
                 if found:
                     return found
-
-        for son in self._sons:
-            found = son._find_one(names, with_content, case_sensitive)
-            if found:
-                return found
         return None
 
-    def _find_all(self, names: str, with_content: str, case_sensitive: bool) -> list[Element]:
-        results = []
+    def _find_all_here(
+        self, names: str, names_list: list[str], with_content: str, case_sensitive: bool
+    ) -> list[ElementBase]:
         if self._check_name_match(names=names, case_sensitive=case_sensitive):
             if self._check_content_match(with_content, case_sensitive):
-                results.extend([self])
-                for son in self._sons:
-                    results.extend(son._find_all(names, with_content, case_sensitive))
-                return results
-
-        names_list = names.split("|")
+                return [self]
 
+        results = []
         if self._check_name_match(names_list[0], case_sensitive):
             if self._check_content_match(with_content, case_sensitive):
                 sons = []
@@ -260,12 +686,170 @@ class ElementBase:
                     sons.clear()
                     sons.extend(match)
                     match.clear()
+        return results
 
-        for son in self._sons:
-            results.extend(son._find_all(names, with_content, case_sensitive))
+    def _find_one(self, names: str, with_content: str, case_sensitive: bool) -> ElementBase | None:
+        names_list = names.split("|")
+        for element in self._iter_tree(_name_bit(names) | _name_bit(names_list[0])):
+            found = element._find_one_here(names, names_list, with_content, case_sensitive)
+            if found:
+                return found
+        return None
 
+    def _find_all(self, names: str, with_content: str, case_sensitive: bool) -> list[Element]:
+        names_list = names.split("|")
+        results = []
+        for element in self._iter_tree(_name_bit(names) | _name_bit(names_list[0])):
+            results.extend(element._find_all_here(names, names_list, with_content, case_sensitive))
         return results
 
+    def _find_many(self, queries: list[FindQuery]) -> None:
+        """Run all the queries in a single traversal, each query collects its own results.
+        A query can only match an element whose name is its full name or its first name in the path,
+        so queries are indexed by these names and each element evaluates only the relevant ones.
+        """
+        by_name = {}
+        by_casefold_name = {}
+        any_name = []
+        names_bits = 0
+        for query in queries:
+            names_bits |= _name_bit(query.names) | _name_bit(query.names_list[0])
+            if not query.names:
+                any_name.append(query)
+            elif query.case_sensitive:
+                for key in {query.names, query.names_list[0]}:
+                    by_name.setdefault(key, []).append(query)
+            else:
+                for key in {query.names.casefold(), query.names_list[0].casefold()}:
+                    by_casefold_name.setdefault(key, []).append(query)
+
+        if any_name:
+            names_bits = 0  # content only queries, can not skip anything
+
+        remaining = len(queries)
+        for element in self._iter_tree(names_bits):
+            if not remaining:
+                break
+            name = element._name_for_match()
+            candidates = by_name.get(name, [])
+            if by_casefold_name:
+                candidates = candidates + by_casefold_name.get(name.casefold(), [])
+            if any_name:
+                candidates = candidates + any_name
+
+            for query in candidates:
+                if query.only_one:
+                    if query.result is None:
+                        query.result = element._find_one_here(
+                            query.names, query.names_list, query.with_content, query.case_sensitive
+                        )
+                        if query.result is not None:
+                            remaining -= 1
+                else:
+                    query.result.extend(
+                        element._find_all_here(query.names, query.names_list, query.with_content, query.case_sensitive)
+                    )
+
+
+class FindQuery:
+    """A single find() query, as used by find_many()."""
+
+    def __init__(self, name: str = "", only_one: bool = True, with_content: str = None, case_sensitive: bool = True):
+        if not name and with_content is None:
+            raise ValueError("At least one search criteria must be provided")
+        self.names = name
+        self.names_list = name.split("|")
+        self.only_one = only_one
+        self.with_content = with_content
+        self.case_sensitive = case_sensitive
+        self.result = None if only_one else []
+
+
+class Batch:
+    """
+    The changes made inside SmartXML.batch().
+    Each changed element saves its state once, on its first change, so the changes can be rolled back.
+    The derived data (names summaries, comment counters and modification counters) is not maintained
+    on every change, it is reconciled once, for the changed elements and their ancestors, when the batch ends.
+    A batch records the elements of a single document, see ElementBase._active_batch().
+    """
+
+    def __init__(self):
+        self._saved = {}  # id -> (element, class, state, attributes), as they were before the batch
+        self.events = []  # (document, event), passed to the subscribers when the batch ends
+
+    def save(self, element: ElementBase):
+        if id(element) in self._saved:
+            return
+        state = dict(element.__dict__)
+        state["_sons"] = list(element._sons)
+        attributes = state.get("_attributes")
+        attributes = dict(attributes) if attributes is not None else None
+        self._saved[id(element)] = (element, element.__class__, state, attributes)
+
+    def rollback(self):
+        """Bring all the changed elements back to their state before the batch."""
+        for element, _, state, _ in self._saved.values():
+            parent = element._parent
+            if parent is not None and parent is not state.get("_parent") and id(parent) not in self._saved:
+                # moved into another tree, which is not a part of the batch, take it out of there
+                index = next(index for index, son in enumerate(parent._sons) if son is element)
+                del parent._sons[index]
+                element._parent = None
+                parent._sons_removed([element])
+        moved = []
+        for element, cls, state, attributes in self._saved.values():
+            if element._parent is not state.get("_parent") or element._owner is not state.get("_owner"):
+                moved.append(element)
+            element.__class__ = cls
+            element.__dict__.clear()
+            element.__dict__.update(state)
+            if attributes is not None:
+                element._attributes.clear()  # the same dict, the caller may hold it
+                element._attributes.update(attributes)
+        for element, _, _, _ in self._saved.values():
+            element._content = None  # the content memo of a parent is not saved when only its son's text changes
+            if element._parent is not None:
+                element._parent._content = None
+        for element in moved:
+            element._set_owner(element._find_owner())  # its descendants were not saved
+        self._changed_trees()
+
+    def commit(self):
+        """Reconcile the derived data of the changed elements and their ancestors."""
+        dirty = {}
+        for element, _, _, _ in self._saved.values():
+            while element is not None and id(element) not in dirty:
+                dirty[id(element)] = element
+                element = element._parent
+
+        for element in sorted(dirty.values(), key=ElementBase.get_depth, reverse=True):  # sons before parents
+            comments = 0
+            for son in element._sons:
+                comments += son._comments_below + son.is_comment()
+            element._comments_below = comments
+            if element._summary is not None:
+                summary = _name_bit(element._name_for_match())
+                for son in element._sons:
+                    if son._summary is None:
+                        son._build_summary()
+                    summary |= son._summary
+                element._summary = summary
+        self._changed_trees()
+        for document, event in self.events:
+            document._notify(event)
+
+    def _changed_trees(self):
+        """Bump the modification counters, and the structure epochs, of all the changed documents."""
+        documents = {}
+        for element, _, _, _ in self._saved.values():
+            document = element._document()
+            if document is not None:
+                documents[id(document)] = document
+        for document in documents.values():
+            document._version += 1
+            document._structure_changed()
+
 
 class PlaceHolder(ElementBase):
     """An element that has been removed from the XML tree."""
@@ -287,7 +871,7 @@ class ContentOnly(ElementBase):
 
     def _to_string(self, index: int, indentation: str) -> str:
         indent = indentation * index
-        if self._get_index_in_parent() == 0:
+        if self._parent is not None and self._parent._sons[0] is self:
             return f"{indent}{self._text}"
         else:
             return f"{indent}{self._text}\n"
@@ -312,12 +896,65 @@ class ContentOnly(ElementBase):
     @text.setter
     def text(self, text: str):
         """Set the content of the element."""
+        self._save_state()
+        old_text = self._text if ElementBase._observed else None
         self._text = str(text)
+        if self._parent is not None:
+            self._parent._content = None
+        self._mark_modified()
+        if ElementBase._observed:
+            self._notify(Event(EventType.content_change, self, old=old_text, new=self._text))
+
+    def _copy(self) -> "ElementBase":
+        element = super()._copy()
+        element._text = self._text
+        return element
+
+    def _set_first_line(self, text: str):
+        self.text = text
+
+    def _is_multi_line(self) -> bool:
+        return False
+
+    def _to_string_as_first_son(self, index: int, indentation: str) -> tuple[str, str]:
+        """
+        Convert to a string, when written right after the parent's opening tag
+        :return: the text for the line of the opening tag, and the text for the following lines
+        """
+        return self._text, ""
 
     def __repr__(self):
         return f"{self._text}"
 
 
+class ContentLines(ContentOnly):
+    """
+    Several lines of text, read from the file as a single block.
+    Each line is written on its own line, like a sequence of ContentOnly elements.
+    """
+
+    def _to_string(self, index: int, indentation: str) -> str:
+        indent = indentation * index
+        return "".join(f"{indent}{line}\n" for line in self._text.split("\n"))
+
+    def _set_first_line(self, text: str):
+        first_line_end = self._text.find("\n")
+        if first_line_end == -1:
+            self.text = text
+        else:
+            self.text = str(text) + self._text[first_line_end:]
+
+    def _is_multi_line(self) -> bool:
+        return "\n" in self._text
+
+    def _to_string_as_first_son(self, index: int, indentation: str) -> tuple[str, str]:
+        first_line, separator, other_lines = self._text.partition("\n")
+        if not separator:
+            return first_line, ""
+        indent = indentation * index
+        return first_line, "".join(f"{indent}{line}\n" for line in other_lines.split("\n"))
+
+
 class TextOnlyComment(ElementBase):
     """A comment that only contains text, not other elements."""
 
@@ -330,20 +967,24 @@ class TextOnlyComment(ElementBase):
         """Get the content of the element."""
         return self._text
 
-    def _check_name_match(self, names: str, case_sensitive: bool) -> bool:
-        if names:
-            if case_sensitive:
-                if self.text != names:
-                    return False
-            else:
-                if self.text.casefold() != names.casefold():
-                    return False
-        return True
+    def _name_for_match(self) -> str:
+        return self._text
+
+    def _copy(self) -> "ElementBase":
+        element = super()._copy()
+        element._text = self._text
+        return element
 
     @text.setter
     def text(self, text: str):
         """Set the content of the element."""
+        self._save_state()
+        old_text = self._text if ElementBase._observed else None
         self._text = text
+        self._add_name_to_summaries()
+        self._mark_modified()
+        if ElementBase._observed:
+            self._notify(Event(EventType.content_change, self, old=old_text, new=text))
 
     def is_comment(self) -> bool:
         return True
@@ -367,6 +1008,11 @@ class CData(ElementBase):
         indent = indentation * index
         return f"{indent}<![CDATA[{self._text}]]>\n"
 
+    def _copy(self) -> "ElementBase":
+        element = super()._copy()
+        element._text = self._text
+        return element
+
     @property
     def text(self) -> str:
         """Get the content of the element."""
@@ -375,7 +1021,55 @@ class CData(ElementBase):
     @text.setter
     def text(self, text: str):
         """Set the content of the element."""
+        self._save_state()
+        old_text = self._text if ElementBase._observed else None
         self._text = text
+        self._mark_modified()
+        if ElementBase._observed:
+            self._notify(Event(EventType.content_change, self, old=old_text, new=text))
+
+
+class SourceText:
+    """
+    A mixin for text elements that reference a range of the read XML text, instead of keeping a copy of it.
+    The text is sliced out of the source only when it is accessed or written.
+    Setting a new text drops the reference to the source.
+    """
+
+    def __init__(self, source: str, start: int, end: int):
+        ElementBase.__init__(self, "")
+        self._source = source
+        self._start = start
+        self._end = end
+
+    @property
+    def _text(self) -> str:
+        return self._source[self._start : self._end]
+
+    def _copy(self) -> "ElementBase":
+        element = ElementBase._copy(self)
+        element._source = self._source
+        element._start = self._start
+        element._end = self._end
+        return element
+
+    @_text.setter
+    def _text(self, text: str):
+        self._source = text
+        self._start = 0
+        self._end = len(text)
+
+
+class SourceContentOnly(SourceText, ContentOnly):
+    """A ContentOnly element that references the read XML text."""
+
+
+class SourceTextOnlyComment(SourceText, TextOnlyComment):
+    """A TextOnlyComment element that references the read XML text."""
+
+
+class SourceCData(SourceText, CData):
+    """A CData element that references the read XML text."""
 
 
 class Doctype(ElementBase):
@@ -385,6 +1079,11 @@ class Doctype(ElementBase):
         super().__init__("")
         self._text = text
 
+    def _copy(self) -> "ElementBase":
+        element = super()._copy()
+        element._text = self._text
+        return element
+
     def _to_string(self, index: int, indentation: str) -> str:
         indent = indentation * index
         sons_indent = indentation * (index + 1)
@@ -403,11 +1102,42 @@ class Doctype(ElementBase):
 class Element(ElementBase):
     """An XML element that can contain attributes, content, and child elements."""
 
+    _attributes = None  # created on first access, from _raw_attributes
+    _raw_attributes = ""  # the attributes as read from the file, already validated
+
     def __init__(self, name: str):
         super().__init__(name)
-        self.attributes = {}
         self._is_empty = False  # whether the element is self-closing
 
+    @property
+    def attributes(self) -> dict[str, str]:
+        """Get the attributes of the element."""
+        if ElementBase._batches:
+            self._save_state()  # the caller may change the attributes
+        if self._attributes is None:
+            self._attributes = dict(_ATTRIBUTE_RE.findall(self._raw_attributes))
+            self._raw_attributes = ""
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes: dict[str, str]):
+        """Set the attributes of the element."""
+        self._save_state()
+        old_attributes = self.attributes if ElementBase._observed else None
+        self._attributes = attributes
+        self._raw_attributes = ""
+        if ElementBase._observed:
+            self._notify(Event(EventType.attribute_change, self, old=old_attributes, new=attributes))
+
+    def _copy(self) -> "ElementBase":
+        element = super()._copy()
+        element._is_empty = self._is_empty
+        if self._attributes is None:
+            element._raw_attributes = self._raw_attributes
+        else:
+            element._attributes = dict(self._attributes)
+        return element
+
     def uncomment(self):
         if self.parent.is_comment():
             raise IllegalOperation("Cannot comment out an element whose parent is a comment")
@@ -416,58 +1146,130 @@ class Element(ElementBase):
         """Convert this element into a comment.
         raises IllegalOperation, if any parent or any descended is a comment
         """
+        self._update_position()
+        if self._in_comment:
+            raise IllegalOperation("Cannot comment out an element whose parent is a comment")
 
-        def find_comment_son(element: "ElementBase") -> bool:
-            if element.is_comment():
-                return True
-            for a_son in element._sons:
-                if find_comment_son(a_son):
-                    return True
-            return False
-
-        parent = self.parent
-        while parent:
-            if parent.is_comment():
-                raise IllegalOperation("Cannot comment out an element whose parent is a comment")
-            parent = parent.parent
+        if self._active_batch() is None:
+            has_comments_below = self._comments_below > 0
+        else:  # the counters are not maintained inside a batch
+            has_comments_below = any(element.is_comment() for element in self._iter_tree() if element is not self)
+        if has_comments_below:
+            raise IllegalOperation("Cannot comment out an element whose descended is a comment")
+
+        if not self.is_comment():
+            self._save_state()
+            self.__class__ = Comment
+            self._structure_changed()
+            if self._parent is not None:
+                self._parent._add_to_comments_below(1)
+            if ElementBase._observed:
+                self._notify(Event(EventType.comment_out, self))
+        self._mark_modified()
+
+    def insert_sons(self, index: int, sons: Iterable["ElementBase"]):
+        """
+        Insert several elements as sons of this element, in a single pass
+        :param index: position, in the current sons, to insert the elements at
+        :param sons: the elements to insert, they are removed from their current parents
+        :raises:
+            ValueError: if an element appears more than once
+        """
+        sons = list(sons)
+        if not sons:
+            return
+        moved = {id(son) for son in sons}
+        if len(moved) != len(sons):
+            raise ValueError("An element can not be inserted more than once")
+
+        before = [son for son in self._sons[:index] if id(son) not in moved]
+        after = [son for son in self._sons[index:] if id(son) not in moved]
+
+        old_parents = {id(son._parent): son._parent for son in sons if son._parent is not None}
+        self._save_state()
+        for son in sons:
+            son._save_state()  # for the batch of the tree it leaves
+            son._save_state(self)  # and for the batch of the tree it joins
+            son._leave_document()
+        for old_parent in old_parents.values():
+            old_parent._save_state()
+            removed = [son for son in old_parent._sons if id(son) in moved]
+            old_parent._sons = [son for son in old_parent._sons if id(son) not in moved]
+            for son in removed:
+                son._parent = None
+            old_parent._sons_removed(removed)
+
+        self._sons = before + sons + after
+        for son in sons:
+            son._parent = self
+            if son._owner is not self._owner:
+                son._set_owner(self._owner)
+        self._sons_added(sons)
+
+    def extend_sons(self, sons: Iterable["ElementBase"]):
+        """
+        Add several elements as the last sons of this element, in a single pass
+        :param sons: the elements to add, they are removed from their current parents
+        :raises:
+            ValueError: if an element appears more than once
+        """
+        self.insert_sons(len(self._sons), sons)
 
+    def remove_sons(self, predicate: Callable[["ElementBase"], bool]) -> list["ElementBase"]:
+        """
+        Remove all the sons that match the predicate, in a single pass
+        :param predicate: called with each son, returns True if the son should be removed
+        :return: the removed sons
+        """
+        kept = []
+        removed = []
         for son in self._sons:
-            if find_comment_son(son):
-                raise IllegalOperation("Cannot comment out an element whose descended is a comment")
-
-        self.__class__ = Comment
+            if predicate(son):
+                removed.append(son)
+            else:
+                kept.append(son)
+        if removed:
+            self._save_state()
+            self._sons = kept
+            for son in removed:
+                son._save_state()
+                son._parent = None
+            self._sons_removed(removed)
+            for son in removed:
+                if son._owner is not None:
+                    son._set_owner(None)
+        return removed
 
     def _to_string(self, index: int, indentation: str) -> str:
-        indent = indentation * index
+        return self._write(index, indentation)
 
-        attributes_str = " ".join(
-            f'{key}="{value}"' for key, value in self.attributes.items()  # f-string formats the pair as key="value"
-        )
+    def _write_parts(self, index: int, indentation: str) -> str | tuple[str, list["ElementBase"], int, str]:
+        indent = indentation * index
 
-        attributes_part = f" {attributes_str}" if attributes_str else ""
+        if self._attributes is None and _is_written_as_is(self._raw_attributes):
+            attributes_part = self._raw_attributes  # never accessed, and already written as it should be
+        else:
+            attributes_str = " ".join(
+                f'{key}="{value}"' for key, value in self.attributes.items()  # f-string formats the pair as key="value"
+            )
+            attributes_part = f" {attributes_str}" if attributes_str else ""
 
         if self._is_empty:
-            result = f"{indent}<{self.name}{attributes_part}/>"
-        else:
-            opening_tag = f"<{self.name}{attributes_part}>"
-            closing_tag = f"</{self.name}>"
-
-            first_content = ""
-            children_str = ""
-            if len(self._sons) > 0:
-                if isinstance(self._sons[0], ContentOnly):
-                    first_content = self._sons[0]._text
-                    children_str = "".join(son._to_string(index + 1, indentation) for son in self._sons[1:])
-                else:
-                    children_str = "".join(son._to_string(index + 1, indentation) for son in self._sons)
+            return f"{indent}<{self.name}{attributes_part}/>\n"
 
-            if children_str:
-                result = f"{indent}{opening_tag}{first_content}\n{children_str}{indent}{closing_tag}"
-            else:
-                result = f"{indent}{opening_tag}{first_content}{closing_tag}"
+        opening_tag = f"<{self.name}{attributes_part}>"
+        closing_tag = f"</{self.name}>"
+
+        first_content = ""
+        first_lines = ""
+        sons = self._sons
+        if len(sons) > 0 and isinstance(sons[0], ContentOnly):
+            first_content, first_lines = sons[0]._to_string_as_first_son(index + 1, indentation)
+            sons = sons[1:]
 
-        result += "\n"
-        return result
+        if first_lines or sons:
+            return f"{indent}{opening_tag}{first_content}\n{first_lines}", sons, index + 1, f"{indent}{closing_tag}\n"
+        return f"{indent}{opening_tag}{first_content}{closing_tag}\n"
 
     def find(
         self, name: str = "", only_one: bool = True, with_content: str = None, case_sensitive: bool = True
@@ -501,11 +1303,23 @@ class Comment(Element):
         """Convert this comment back into a normal element."""
         if self.parent.is_comment():
             raise IllegalOperation("Cannot uncomment an element whose parent is a comment")
+        self._save_state()
         self.__class__ = Element
+        self._structure_changed()
+        self._parent._add_to_comments_below(-1)
+        self._mark_modified()
+        if ElementBase._observed:
+            self._notify(Event(EventType.uncomment, self))
 
-    def _to_string(self, index: int, indentation: str) -> str:
+    def _write_parts(self, index: int, indentation: str) -> str | tuple[str, list["ElementBase"], int, str]:
         indent = indentation * index
-        if len(self._sons) == 0 or (len(self._sons) == 1 and isinstance(self._sons[0], ContentOnly)):
-            return f"{indent}<!-- {super()._to_string(0, indentation)[0:-1]} -->\n"
-        else:
-            return f"{indent}<!--\n{super()._to_string(index + 1, indentation)}{indent}-->\n"
+        if len(self._sons) == 0 or (
+            len(self._sons) == 1 and isinstance(self._sons[0], ContentOnly) and not self._sons[0]._is_multi_line()
+        ):
+            return f"{indent}<!-- {super()._write_parts(0, indentation)[0:-1]} -->\n"
+
+        written = super()._write_parts(index + 1, indentation)
+        if isinstance(written, str):
+            return f"{indent}<!--\n{written}{indent}-->\n"
+        before, sons, sons_index, after = written
+        return f"{indent}<!--\n{before}", sons, sons_index, f"{after}{indent}-->\n"
@@ -0,0 +1,362 @@
+"""
+Timing of the main phases of smartXML: read (with its tokenize, comment_reparse and build parts), find and write.
+
+Enable it with the SMARTXML_PROFILE environment variable (any value but 0, the summary is printed at exit),
+or with enable(). When disabled, the library runs its own functions, without any timing code around them.
+enable() and disable() replace functions of the library (for all the threads), and the timing state is global,
+so do not call them, or read documents while profiling, from several threads at once.
+
+Query counters (nodes visited, name comparisons and content evaluations of all the searches) are enabled apart,
+with the SMARTXML_QUERY_COUNTERS environment variable or with enable_query_counters(), see also SmartXML.explain().
+
+Usage:
+    from smartXML import profiling
+
+    profiling.enable()
+    xml = SmartXML(Path("data.xml"))
+    xml.find("item", only_one=False)
+    profiling.timing_registry.report()
+    profiling.disable()
+"""
+
+import atexit
+import time
+import functools
+from collections import defaultdict
+from typing import Callable, Any, TypeVar
+
+ReturnType = TypeVar("ReturnType")
+
+
+class TimingRegistry:
+    def __init__(self) -> None:
+        self._stats: dict[str, list[float]] = defaultdict(lambda: [0.0, 0.0])
+        self._documents: dict[str, dict[str, list[float]]] = defaultdict(lambda: defaultdict(lambda: [0.0, 0.0]))
+
+    # index 0 -> total time
+    # index 1 -> call count
+
+    def record(self, function_name: str, elapsed_seconds: float, document: str = None) -> None:
+        stats = self._stats[function_name]
+        stats[0] += elapsed_seconds
+        stats[1] += 1.0
+        if document is not None:
+            stats = self._documents[document][function_name]
+            stats[0] += elapsed_seconds
+            stats[1] += 1.0
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Get the totals of each phase: phase -> {"total": seconds, "calls": count}"""
+        return {name: {"total": total, "calls": int(count)} for name, (total, count) in self._stats.items()}
+
+    def document_stats(self) -> dict[str, dict[str, dict[str, float]]]:
+        """Get the totals of each phase, per document: document -> phase -> {"total": seconds, "calls": count}"""
+        return {
+            document: {name: {"total": total, "calls": int(count)} for name, (total, count) in stats.items()}
+            for document, stats in self._documents.items()
+        }
+
+    def report(self, *, sort_by_total: bool = True) -> None:
+        print("\n=== Timing Summary ===")
+        self._print_stats(self._stats, sort_by_total)
+        for document, stats in self._documents.items():
+            print(f"\n--- {document} ---")
+            self._print_stats(stats, sort_by_total)
+
+    @staticmethod
+    def _print_stats(stats: dict[str, list[float]], sort_by_total: bool) -> None:
+        print(f"{'Function':40} {'Calls':>8} {'Total(s)':>12} {'Avg(ms)':>12}")
+        print("-" * 78)
+
+        items = stats.items()
+        if sort_by_total:
+            items = sorted(items, key=lambda item: item[1][0], reverse=True)
+
+        for function_name, (total_time, call_count) in items:
+            avg_ms = (total_time / call_count) * 1000.0
+            print(f"{function_name:40} {int(call_count):8d} {total_time:12.6f} {avg_ms:12.3f}")
+
+    def clear(self) -> None:
+        self._stats.clear()
+        self._documents.clear()
+
+
+timing_registry = TimingRegistry()
+
+
+def timeit(func: Callable[..., ReturnType]) -> Callable[..., ReturnType]:
+    """Time every call of the decorated function, by its name, whether profiling is enabled or not."""
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> ReturnType:
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed_seconds = time.perf_counter() - start_time
+        timing_registry.record(func.__qualname__, elapsed_seconds)
+        return result
+
+    return wrapper
+
+
+_originals = []  # (owner, attribute name, original function) of the timed functions, while enabled
+_current_document = None  # name of the document being read, for the phases that do not know their document
+_read_seconds = None  # seconds of the read being timed spent on tokenize and comment_reparse, to tell build apart
+_reparse_depth = 0  # comment re-parses in progress, the tokens of a comment are a part of its re-parse
+_report_registered = False
+
+
+def _document_name(document) -> str:
+    if document._file_name:
+        return str(document._file_name)
+    return f"<SmartXML at {id(document):#x}>"
+
+
+def _timed_method(phase: str, method: Callable[..., ReturnType]) -> Callable[..., ReturnType]:
+    @functools.wraps(method)
+    def wrapper(document, *args: Any, **kwargs: Any) -> ReturnType:
+        start_time = time.perf_counter()
+        try:
+            return method(document, *args, **kwargs)
+        finally:
+            timing_registry.record(phase, time.perf_counter() - start_time, _document_name(document))
+
+    return wrapper
+
+
+def _timed_read(method: Callable[..., None]) -> Callable[..., None]:
+    @functools.wraps(method)
+    def wrapper(document, *args: Any, **kwargs: Any) -> None:
+        global _current_document, _read_seconds
+        _current_document = _document_name(document)
+        _read_seconds = {"tokenize": 0.0, "comment_reparse": 0.0}
+        start_time = time.perf_counter()
+        try:
+            method(document, *args, **kwargs)
+        finally:
+            elapsed_seconds = time.perf_counter() - start_time
+            timing_registry.record("read", elapsed_seconds, _current_document)
+            # building the elements, and anything else the read does but tokenize and comment_reparse
+            timing_registry.record("build", elapsed_seconds - sum(_read_seconds.values()), _current_document)
+            _current_document = None
+            _read_seconds = None
+
+    return wrapper
+
+
+def _timed_comment_reparse(read_comment: Callable[..., ReturnType]) -> Callable[..., ReturnType]:
+    @functools.wraps(read_comment)
+    def wrapper(*args: Any, **kwargs: Any) -> ReturnType:
+        global _reparse_depth
+        _reparse_depth += 1
+        start_time = time.perf_counter()
+        try:
+            return read_comment(*args, **kwargs)
+        finally:
+            elapsed_seconds = time.perf_counter() - start_time
+            _reparse_depth -= 1
+            timing_registry.record("comment_reparse", elapsed_seconds, _current_document)
+            if not _reparse_depth and _read_seconds is not None:
+                _read_seconds["comment_reparse"] += elapsed_seconds
+
+    return wrapper
+
+
+def _timed_tokens(tokenize: Callable):
+    """The tokens are generated while the tree is built, so only the time spent generating them is counted."""
+
+    @functools.wraps(tokenize)
+    def wrapper(*args: Any, **kwargs: Any):
+        tokens = tokenize(*args, **kwargs)
+        elapsed_seconds = 0.0
+        # the tokens of a comment are timed as a part of comment_reparse
+        read_seconds = _read_seconds if not _reparse_depth else None
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    token = next(tokens)
+                except StopIteration:
+                    break
+                finally:
+                    token_seconds = time.perf_counter() - start_time
+                    elapsed_seconds += token_seconds
+                    if read_seconds is not None:
+                        read_seconds["tokenize"] += token_seconds  # now, a failed read may never finish the tokens
+                yield token
+        finally:
+            timing_registry.record("tokenize", elapsed_seconds, _current_document)
+
+    return wrapper
+
+
+def enable(report_at_exit: bool = False) -> None:
+    """
+    Start timing the phases of all SmartXML documents.
+    The timed functions are replaced by timing wrappers, in their modules and classes, so it is not thread safe:
+    enable or disable profiling while no other thread uses the library.
+    :param report_at_exit: print the summary when the program exits
+    """
+    global _report_registered
+    if report_at_exit and not _report_registered:
+        atexit.register(timing_registry.report)
+        _report_registered = True
+    if _originals:
+        return
+
+    from . import xmltree
+
+    timed = [
+        (xmltree.SmartXML, "_build_tree", _timed_read),
+        (xmltree.SmartXML, "find", functools.partial(_timed_method, "find")),
+        (xmltree.SmartXML, "find_many", functools.partial(_timed_method, "find")),
+        (xmltree.SmartXML, "_to_string", functools.partial(_timed_method, "write")),
+        (xmltree, "_divide_to_tokens", _timed_tokens),
+        (xmltree, "_read_comment", _timed_comment_reparse),
+    ]
+    for owner, name, timer in timed:
+        original = getattr(owner, name)
+        _originals.append((owner, name, original))
+        setattr(owner, name, timer(original))
+
+
+def disable() -> None:
+    """Stop timing, the collected totals are kept in timing_registry. Not thread safe, see enable()."""
+    while _originals:
+        owner, name, original = _originals.pop()
+        setattr(owner, name, original)
+
+
+def is_enabled() -> bool:
+    return bool(_originals)
+
+
+class QueryCounters:
+    """The work done by searches, see enable_query_counters()."""
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        self.queries = 0
+        self.nodes_visited = 0  # nodes the traversals went over, subtrees skipped by names summaries are not visited
+        self.name_comparisons = 0
+        self.content_evaluations = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "queries": self.queries,
+            "nodes_visited": self.nodes_visited,
+            "name_comparisons": self.name_comparisons,
+            "content_evaluations": self.content_evaluations,
+            "seconds": self.seconds,
+        }
+
+    def report(self) -> None:
+        print("\n=== Query Counters ===")
+        for name, value in self.as_dict().items():
+            print(f"{name:40} {value:12}")
+
+
+query_counters = QueryCounters()
+
+_active_counters = []  # every counted search adds to all of them
+_counting_originals = []  # (owner, attribute name, original function) of the counted functions, while counting
+_counters_report_registered = False
+
+
+def _counted_traversal(iter_tree: Callable):
+    @functools.wraps(iter_tree)
+    def wrapper(*args: Any, **kwargs: Any):
+        for element in iter_tree(*args, **kwargs):
+            for counters in _active_counters:
+                counters.nodes_visited += 1
+            yield element
+
+    return wrapper
+
+
+def _counted_name_match(check_name_match: Callable[..., bool]) -> Callable[..., bool]:
+    @functools.wraps(check_name_match)
+    def wrapper(element, names: str, case_sensitive: bool) -> bool:
+        if names:
+            for counters in _active_counters:
+                counters.name_comparisons += 1
+        return check_name_match(element, names, case_sensitive)
+
+    return wrapper
+
+
+def _counted_content_match(check_content_match: Callable[..., bool]) -> Callable[..., bool]:
+    @functools.wraps(check_content_match)
+    def wrapper(element, with_content: str, case_sensitive: bool) -> bool:
+        if with_content is not None:
+            for counters in _active_counters:
+                counters.content_evaluations += 1
+        return check_content_match(element, with_content, case_sensitive)
+
+    return wrapper
+
+
+def _counted_query(find: Callable[..., ReturnType]) -> Callable[..., ReturnType]:
+    @functools.wraps(find)
+    def wrapper(*args: Any, **kwargs: Any) -> ReturnType:
+        start_time = time.perf_counter()
+        try:
+            return find(*args, **kwargs)
+        finally:
+            elapsed_seconds = time.perf_counter() - start_time
+            for counters in _active_counters:
+                counters.queries += 1
+                counters.seconds += elapsed_seconds
+
+    return wrapper
+
+
+def _start_counting(counters: QueryCounters) -> None:
+    _active_counters.append(counters)
+    if _counting_originals:
+        return
+
+    from .element import ElementBase
+
+    counted = [
+        ("_iter_tree", _counted_traversal),
+        ("_check_name_match", _counted_name_match),
+        ("_check_content_match", _counted_content_match),
+        ("_find_one", _counted_query),
+        ("_find_all", _counted_query),
+        ("_find_many", _counted_query),
+    ]
+    for name, counter in counted:
+        original = getattr(ElementBase, name)
+        _counting_originals.append((ElementBase, name, original))
+        setattr(ElementBase, name, counter(original))
+
+
+def _stop_counting(counters: QueryCounters) -> None:
+    _active_counters.remove(counters)
+    if _active_counters:
+        return
+    while _counting_originals:
+        owner, name, original = _counting_originals.pop()
+        setattr(owner, name, original)
+
+
+def enable_query_counters(report_at_exit: bool = False) -> None:
+    """
+    Start counting the work of all searches, into query_counters
+    :param report_at_exit: print the counters when the program exits
+    """
+    global _counters_report_registered
+    if report_at_exit and not _counters_report_registered:
+        atexit.register(query_counters.report)
+        _counters_report_registered = True
+    if query_counters not in _active_counters:
+        _start_counting(query_counters)
+
+
+def disable_query_counters() -> None:
+    """Stop counting, the collected numbers are kept in query_counters."""
+    if query_counters in _active_counters:
+        _stop_counting(query_counters)
@@ -1,12 +1,46 @@
 from __future__ import annotations
 
+import gc
+import math
 import os
+import re
+import struct
+import sys
+import time
+import tracemalloc
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 from enum import Enum
-
-from .element import ElementBase, Element, CData, Doctype, TextOnlyComment, ContentOnly
-
-# from tests.time_check import timeit
+from typing import Callable, Iterator
+
+from . import profiling
+from .element import (
+    _ATTRIBUTE_RE,
+    Batch,
+    ElementBase,
+    Element,
+    Event,
+    CData,
+    Doctype,
+    TextOnlyComment,
+    ContentOnly,
+    ContentLines,
+    FindQuery,
+    SourceContentOnly,
+    SourceTextOnlyComment,
+    SourceCData,
+    StructureEpoch,
+    _name_bit,
+)
+
+
+_PAUSE_GC_MIN_SIZE = 1_000_000  # texts from this size are read with the cyclic garbage collector paused
+_PROGRESS_STEP = 1_000_000  # default bytes between calls of a progress callback
+_TOKENS_SAMPLE = 16  # ParseStats times one token in this many, as timing every token slows the read down
+_SPECIAL_CHARS_RE = re.compile(r"[<>\n!]")  # the only characters the tokenizer acts on
+_ATTRIBUTES_RE = re.compile(r'(?:\s+[A-Za-z][^\s=]*\s*=\s*"[^"]*")*\s*')
 
 
 class BadXMLFormat(Exception):
@@ -15,6 +49,14 @@ class BadXMLFormat(Exception):
         super().__init__(self.message)
 
 
+class LimitExceeded(BadXMLFormat):
+    """The XML exceeds one of the limits given to SmartXML, see Limits."""
+
+
+class OperationCancelled(Exception):
+    """A read or a write was stopped by its CancellationToken."""
+
+
 class TokenType(Enum):
     comment = 1
     full_tag_name = 2
@@ -24,33 +66,46 @@ class TokenType(Enum):
     doctype = 6
 
 
+_TEXT_TOKENS = (TokenType.content, TokenType.c_data, TokenType.comment)
+
+
 class Token:
-    def __init__(self, token_type: TokenType, data: str, line_number: int):
+    def __init__(self, token_type: TokenType, data: str, line_number: int, start: int = -1):
         self.token_type = token_type
         self.data = data
         self.line_number = line_number
+        self.start = start  # index in the text where the data starts (before stripping), if known
 
     def __repr__(self):
         return f"{self.token_type.name}: {self.data}"
 
 
-def _divide_to_tokens(file_content):
-    tokens = []
-
+def _divide_to_tokens(file_content, progress: "_Progress" = None):
+    """
+    Generate the tokens of the text, one by one, so only the current token's data is kept in memory.
+    :param progress: if given, told the position in the text every progress.interval characters
+    """
     last_char: str = ""
     last_index: int = 0
     line_number: int = 1
 
     index = 0
     length = len(file_content)
+    next_progress = progress.reached(0) if progress is not None else length
     while index < length:
+        match = _SPECIAL_CHARS_RE.search(file_content, index)  # skip over text and names at once
+        if match is None:
+            break
+        index = match.start()
+        if index >= next_progress:
+            next_progress = progress.reached(index)
         char = file_content[index]
 
         if char == ">":
             if last_char == "<":
-                tokens.append(Token(TokenType.full_tag_name, file_content[last_index + 1 : index].strip(), line_number))
+                yield Token(TokenType.full_tag_name, file_content[last_index + 1 : index].strip(), line_number)
             else:
-                tokens.append(Token(TokenType.closing, file_content[last_index + 1 : index].strip(), line_number))
+                yield Token(TokenType.closing, file_content[last_index + 1 : index].strip(), line_number)
             last_char = char
             last_index = index
         elif char == "<":
@@ -60,7 +115,7 @@ def _divide_to_tokens(file_content):
                 text = file_content[last_index + 1 : index]
                 text = text.strip()
                 if text:
-                    tokens.append(Token(TokenType.content, text, line_number))
+                    yield Token(TokenType.content, text, line_number, last_index + 1)
             last_char = char
             last_index = index
         elif char == "\n":
@@ -73,7 +128,7 @@ def _divide_to_tokens(file_content):
                     raise BadXMLFormat(f"Malformed comment in line {line_number}")
 
                 comment = file_content[index + 3 : comment_end_index]
-                tokens.append(Token(TokenType.comment, comment, line_number))
+                yield Token(TokenType.comment, comment, line_number, index + 3)
 
                 last_char = ""
                 last_index = comment_end_index + 3
@@ -84,7 +139,7 @@ def _divide_to_tokens(file_content):
                 if cdata_end == -1:
                     raise BadXMLFormat(f"Malformed CDATA section in line {line_number}")
                 cdata_content = file_content[index + 8 : cdata_end]
-                tokens.append(Token(TokenType.c_data, cdata_content, line_number))
+                yield Token(TokenType.c_data, cdata_content, line_number, index + 8)
                 last_index = cdata_end + 2
                 last_char = ">"
                 index = last_index
@@ -94,7 +149,7 @@ def _divide_to_tokens(file_content):
                 if start == -1:
                     raise BadXMLFormat(f"Malformed DOCTYPE declaration in line {line_number}")
                 doctype = file_content[index:start]
-                tokens.append(Token(TokenType.doctype, doctype, line_number))
+                yield Token(TokenType.doctype, doctype, line_number)
 
                 last_char = ""
                 last_index = start + 1
@@ -102,15 +157,286 @@ def _divide_to_tokens(file_content):
 
         index += 1
 
-    return tokens
+    if progress is not None:
+        progress.reached(length)
+
+
+def _utf8_size(text: str) -> int:
+    """Get the size of the text, UTF-8 encoded, without encoding all of it at once."""
+    if text.isascii():
+        return len(text)
+    step = _PROGRESS_STEP
+    return sum(len(text[start : start + step].encode("utf-8")) for start in range(0, len(text), step))
+
+
+class CancellationToken:
+    """
+    Stops a read or a write from another thread (e.g. a UI or a job scheduler), see SmartXML.read() and
+    SmartXML.write(). The operation raises OperationCancelled within milliseconds of cancel().
+    """
+
+    def __init__(self):
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def _check(self):
+        if self._cancelled:
+            raise OperationCancelled("The operation was cancelled")
+
+
+class _Progress:
+    """Reports the progress of a read or a write to its callback, and stops it if it is cancelled."""
+
+    _CANCEL_CHECK_BYTES = 16_384  # read or written in a few milliseconds
+
+    def __init__(
+        self,
+        callback: Callable[[int, int], None],
+        cancel_token: CancellationToken,
+        step: int,
+        total_bytes: int,
+        length: int = None,
+    ):
+        """
+        :param callback: called with (bytes_done, bytes_total), every step bytes and once at the end
+        :param step: bytes between calls of the callback
+        :param total_bytes: size of the whole work
+        :param length: size of the whole work in the units reached() is called with (e.g. characters of a text),
+                if they are not bytes
+        """
+        self._callback = callback
+        self._cancel_token = cancel_token
+        self._step = max(step, 1)
+        self._total_bytes = total_bytes
+        self._scale = total_bytes / length if length else 1.0
+        self._next_report = 0
+        check_bytes = min(self._step, self._CANCEL_CHECK_BYTES) if cancel_token is not None else self._step
+        self.interval = max(int(check_bytes / self._scale), 1) if self._scale else check_bytes
+        self.offset = 0  # added to the positions given to reached(), e.g. for a part of the text that was skipped
+
+    def reached(self, position: int) -> int:
+        """
+        Report the position of the work, in its units
+        :return: the position to call again at
+        """
+        if self._cancel_token is not None:
+            self._cancel_token._check()
+        if self._callback is not None:
+            bytes_done = min(int((position + self.offset) * self._scale), self._total_bytes)
+            if bytes_done >= self._next_report:
+                self._callback(bytes_done, self._total_bytes)
+                self._next_report = (
+                    min(bytes_done + self._step, self._total_bytes) if bytes_done < self._total_bytes else math.inf
+                )
+        return position + self.interval
+
+
+class ParseStats:
+    """Counters collected while reading, see the parse_stats option of SmartXML."""
+
+    def __init__(self):
+        self.bytes = 0  # size of the text, UTF-8 encoded
+        self.tokens = 0
+        self.elements = {}  # class name -> count
+        self.max_depth = 0
+        self.max_fan_out = 0  # the most sons of a single element
+        self.comments_reparsed = 0  # comments read as commented out elements
+        self.seconds = {}  # phase (tokenize, build, total) -> seconds, build is the total without tokenize (estimated)
+
+    def mb_per_second(self) -> dict[str, float]:
+        """Get the throughput of each phase, in megabytes of text per second."""
+        return {phase: self.bytes / 1_000_000 / seconds for phase, seconds in self.seconds.items() if seconds > 0}
+
+    def as_dict(self) -> dict:
+        """Get all the counters, e.g. to feed them to a metrics system."""
+        return {
+            "bytes": self.bytes,
+            "tokens": self.tokens,
+            "elements": dict(self.elements),
+            "max_depth": self.max_depth,
+            "max_fan_out": self.max_fan_out,
+            "comments_reparsed": self.comments_reparsed,
+            "seconds": dict(self.seconds),
+            "mb_per_second": self.mb_per_second(),
+        }
+
+    def _count_tokens(self, tokens):
+        """Count the tokens, and estimate the time spent generating them from the time of one in _TOKENS_SAMPLE."""
+        next_token = tokens.__next__
+        perf_counter = time.perf_counter
+        count = 0
+        sampled = 0
+        sampled_seconds = 0.0
+        try:
+            while True:
+                if count % _TOKENS_SAMPLE:
+                    try:
+                        token = next_token()
+                    except StopIteration:
+                        break
+                else:
+                    start_time = perf_counter()
+                    try:
+                        token = next_token()
+                    except StopIteration:
+                        break
+                    finally:
+                        sampled_seconds += perf_counter() - start_time
+                        sampled += 1
+                count += 1
+                yield token
+        finally:
+            # the counters are stored once, at the end, even if the read fails
+            self.tokens += count
+            if sampled:
+                elapsed_seconds = sampled_seconds * max(count, sampled) / sampled
+                self.seconds["tokenize"] = self.seconds.get("tokenize", 0.0) + elapsed_seconds
+
+    def _count_elements(self, roots: list[ElementBase]):
+        stack = [(root, 0) for root in roots]
+        while stack:
+            element, depth = stack.pop()
+            class_name = type(element).__name__
+            self.elements[class_name] = self.elements.get(class_name, 0) + 1
+            self.max_depth = max(self.max_depth, depth)
+            self.max_fan_out = max(self.max_fan_out, len(element._sons))
+            stack.extend((son, depth + 1) for son in element._sons)
+
+
+class Limits:
+    """
+    Limits on the XML to read, so a huge or hostile document fails fast, before it uses all the memory or CPU.
+    Every limit is optional, None means no limit.
+    Elements inside comments are read too, so they count as well.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = None,
+        max_nodes: int = None,
+        max_depth: int = None,
+        max_attributes: int = None,
+        max_text_length: int = None,
+        time_limit: float = None,
+    ):
+        """
+        :param max_bytes: size of the XML, UTF-8 encoded
+        :param max_nodes: number of elements, texts, comments and CDATA sections
+        :param max_depth: nesting level of elements
+        :param max_attributes: number of attributes of a single element
+        :param max_text_length: length of a single text, comment or CDATA section
+        :param time_limit: seconds the read may take
+        """
+        self.max_bytes = max_bytes
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_attributes = max_attributes
+        self.max_text_length = max_text_length
+        self.time_limit = time_limit
+
+    def _check_size(self, size: int, unit: str = "bytes"):
+        if self.max_bytes is not None and size > self.max_bytes:
+            raise LimitExceeded(f"XML size of {size} {unit} exceeds max_bytes ({self.max_bytes})")
+
+    def _check_text(self, text: str):
+        if self.max_bytes is None:
+            return
+        self._check_size(len(text), "characters")  # each character is at least a byte
+        if len(text) * 4 > self.max_bytes:  # and at most four
+            self._check_size(len(text.encode("utf-8")))
+
+
+class _LimitsCheck:
+    """
+    The counters of a single read, checked against its Limits.
+    Shared by the comments that are read as elements inside it, so their elements, nesting and time count too.
+    """
+
+    _CHECK_TIME_EVERY = 1024  # tokens
+
+    def __init__(self, limits: Limits):
+        self._limits = limits
+        self._deadline = time.monotonic() + limits.time_limit if limits.time_limit is not None else None
+        self._max_nodes = limits.max_nodes if limits.max_nodes is not None else math.inf
+        self._max_depth = limits.max_depth if limits.max_depth is not None else math.inf
+        self._max_attributes = limits.max_attributes if limits.max_attributes is not None else math.inf
+        self._max_text_length = limits.max_text_length if limits.max_text_length is not None else math.inf
+        self.nodes = 0
+        self._tokens = 0
+        self.depth_offset = 0  # depth, in the document, of the comment being read, 0 for the document itself
+
+    def check_depth(self, depth: int, line_number: int):
+        if depth + self.depth_offset > self._max_depth:
+            raise LimitExceeded(f"Nesting exceeds max_depth ({self._limits.max_depth}) in line {line_number}")
+
+    def check_tokens(self, tokens):
+        """Check the tokens one by one, as they are generated."""
+        limits = self._limits
+        for token in tokens:
+            token_type = token.token_type
+            if token_type == TokenType.full_tag_name:
+                if not token.data.startswith("/"):
+                    self.nodes += 1
+                    data = token.data
+                    if (
+                        data.count("=") > self._max_attributes
+                        and len(_ATTRIBUTE_RE.findall(data)) > self._max_attributes
+                    ):
+                        raise LimitExceeded(
+                            f"Element has more than max_attributes ({limits.max_attributes}) "
+                            f"in line {token.line_number}"
+                        )
+            elif token_type in _TEXT_TOKENS:
+                self.nodes += 1
+                if len(token.data) > self._max_text_length:
+                    raise LimitExceeded(
+                        f"Text exceeds max_text_length ({limits.max_text_length}) in line {token.line_number}"
+                    )
+            if self.nodes > self._max_nodes:
+                raise LimitExceeded(f"XML exceeds max_nodes ({limits.max_nodes}) in line {token.line_number}")
+            self._tokens += 1
+            if (
+                self._deadline is not None
+                and self._tokens % self._CHECK_TIME_EVERY == 1
+                and time.monotonic() >= self._deadline
+            ):
+                raise LimitExceeded(
+                    f"Reading exceeds time_limit ({limits.time_limit} seconds) in line {token.line_number}"
+                )
+            yield token
+
+
+def _parse_declaration(file_content: str) -> tuple[str | None, str]:
+    """
+    Split the XML declaration from the text
+    :return: the declaration, None if there is none, and the text after it
+    """
+    start = file_content.find("<?xml")
+    end = file_content.find("?>", start)
+    if (start >= 0 and end == -1) or (start == -1 and end > 0):
+        raise BadXMLFormat("Malformed XML declaration")
+    if start > 0:
+        raise BadXMLFormat("XML declaration must be at the beginning of the file")
+    if start >= 0 and end >= 0:
+        return file_content[start + 5 : end].strip(), file_content[end + 2 :]
+    return None, file_content
 
 
 def _add_ready_token(incomplete_nodes, ready_nodes, element: ElementBase, depth: int):
     if len(incomplete_nodes) == 0:
         ready_nodes.setdefault(depth, []).append(element)
     else:
-        incomplete_nodes[-1]._sons.append(element)
-        element._parent = incomplete_nodes[-1]
+        parent = incomplete_nodes[-1]
+        parent._sons.append(element)
+        element._parent = parent
+        if element._comments_below or element.is_comment():
+            parent._comments_below += element._comments_below + element.is_comment()
 
 
 def _parse_element(text: str) -> Element:
@@ -157,6 +483,12 @@ def _parse_element(text: str) -> Element:
     if not name[0].isalpha():
         raise BadXMLFormat(f'Element name must start with a letter in element definition: "{text}"')
 
+    element = Element(name)
+    if _ATTRIBUTES_RE.fullmatch(text, index):
+        # well-formed attributes (the common case), are turned into a dict only if accessed
+        element._raw_attributes = text[index:]
+        return element
+
     attributes: dict[str, str] = {}
 
     while index < length:
@@ -168,17 +500,87 @@ def _parse_element(text: str) -> Element:
             raise BadXMLFormat(f'Could not parse attribute name in element definition: "{text}"')
         attributes[key] = value
 
-    element = Element(name)
     element.attributes = attributes
     return element
 
 
-def _read_elements(text: str) -> list[Element]:
+def _may_be_elements(text: str) -> bool:
+    """
+    A cheap check, before parsing the text of a comment, that rules out texts the parser would surely reject:
+    an opening tag, that is not self-closing, can not be closed without another '>', as in <!-- plain text -->.
+    """
+    if text.lstrip().startswith("<!"):
+        return True
+    first_end = text.find(">")
+    if first_end == -1:
+        return False
+    if text[first_end - 1] == "/":
+        return True
+    return text.find(">", first_end + 1) != -1
+
+
+def _read_comment(
+    data: str, reference_source: bool, limits: _LimitsCheck = None, depth: int = 0
+) -> list[Element] | None:
+    """
+    Parse the text of a comment as commented out elements
+    :param limits: the limits of the read the comment is a part of
+    :param depth: the depth of the comment in the document, for the max_depth limit
+    :return: the elements, or None if the text can not be parsed and should be handled as plain text
+    :raises:
+        LimitExceeded: if the elements exceed the limits
+    """
+    if limits is not None:
+        nodes = limits.nodes
+        limits.depth_offset += depth
+    try:
+        if data.strip()[0] != "<":
+            # support the case of <!--TAG...-->
+            text = "<" + data + ">"
+        else:
+            text = data
+        if not _may_be_elements(text):
+            return None
+        elements = _read_elements(text, reference_source, limits=limits)
+        for element in elements:
+            element.comment_out()
+    except LimitExceeded:
+        raise
+    except Exception:
+        if limits is not None:
+            limits.nodes = nodes  # read as a single text node
+        return None
+    finally:
+        if limits is not None:
+            limits.depth_offset -= depth
+    return elements
+
+
+def _read_elements(
+    text: str,
+    reference_source: bool = False,
+    stats: ParseStats = None,
+    limits: _LimitsCheck = None,
+    progress: _Progress = None,
+) -> list[Element]:
+    """
+    Parse the text into elements
+    :param text: XML text
+    :param reference_source: text, comment and CDATA elements reference ranges of the text instead of copying them
+    :param stats: if given, collect the counters of the tokens and the comments into it
+    :param limits: if given, raise LimitExceeded as soon as the text exceeds the limits of the read
+    :param progress: if given, report the progress of the tokenizer to it
+    :return: the outer elements
+    """
     ready_nodes = {}  # depth -> list of elements
     incomplete_nodes = []
     depth = 0
 
-    tokens = _divide_to_tokens(text)
+    tokens = _divide_to_tokens(text, progress)
+    if stats is not None:
+        tokens = stats._count_tokens(tokens)
+    if limits is not None:
+        tokens = limits.check_tokens(tokens)
 
     for token in tokens:
         token_type = token.token_type
@@ -190,6 +592,8 @@ def _read_elements(text: str) -> list[Element]:
             if data.endswith("/"):
                 element: ElementBase = _parse_element(data[:-1])
                 element._is_empty = True
+                if limits is not None:
+                    limits.check_depth(depth + 1, line_number)
                 _add_ready_token(incomplete_nodes, ready_nodes, element, depth + 1)
 
             elif data.startswith("/"):
@@ -212,24 +616,24 @@ def _read_elements(text: str) -> list[Element]:
 
                     incomplete_nodes.append(element)
                     depth += 1
+                    if limits is not None:
+                        limits.check_depth(depth, line_number)
 
         elif token_type == TokenType.comment:
             if data.find("!--") != -1:
                 raise BadXMLFormat(f"Nested comments are not allowed in line {line_number}")
-            try:
-                if data.strip()[0] != "<":
-                    elements_in_comment = _read_elements("<" + data + ">")  # support the case of <!--TAG...-->
-                else:
-                    elements_in_comment = _read_elements(data)
+            elements_in_comment = _read_comment(data, reference_source, limits, depth)
+            if elements_in_comment is not None:
+                if stats is not None:
+                    stats.comments_reparsed += 1
                 for comment in elements_in_comment:
-                    comment.comment_out()
                     _add_ready_token(incomplete_nodes, ready_nodes, comment, depth + 1)
                 continue
-            except Exception as e:
-                # The content of the comment can not be parsed, so handle this as plain text
-                pass
 
-            element = TextOnlyComment(data)
+            if reference_source:
+                element = SourceTextOnlyComment(text, token.start, token.start + len(data))
+            else:
+                element = TextOnlyComment(data)
 
             _add_ready_token(incomplete_nodes, ready_nodes, element, depth + 1)
 
@@ -239,10 +643,17 @@ def _read_elements(text: str) -> list[Element]:
             depth -= 1
 
         elif token_type == TokenType.content:
-            data = data.splitlines()
-            for content in data:
-                content_only = ContentOnly(content.strip())
-                _add_ready_token(incomplete_nodes, ready_nodes, content_only, depth + 1)
+            lines = data.splitlines()
+            if len(lines) == 1:
+                if reference_source:
+                    start = text.find(data, token.start)  # the data is stripped
+                    content_only = SourceContentOnly(text, start, start + len(data))
+                else:
+                    content_only = ContentOnly(data)
+            else:
+                # a single node for all the lines, instead of a ContentOnly per line
+                content_only = ContentLines("\n".join(line.strip() for line in lines))
+            _add_ready_token(incomplete_nodes, ready_nodes, content_only, depth + 1)
 
         elif token_type == TokenType.doctype:
             element = Doctype(data)
@@ -250,7 +661,10 @@ def _read_elements(text: str) -> list[Element]:
             depth += 1
 
         elif token_type == TokenType.c_data:
-            element = CData(data)
+            if reference_source:
+                element = SourceCData(text, token.start, token.start + len(data))
+            else:
+                element = CData(data)
             _add_ready_token(incomplete_nodes, ready_nodes, element, depth + 1)
 
     if incomplete_nodes:
@@ -263,12 +677,67 @@ def _read_elements(text: str) -> list[Element]:
     return ready_nodes[1]
 
 
+def _stop_observing():
+    """Stop counting a document in ElementBase._observed, once it has no subscribers, or is dropped."""
+    ElementBase._observed -= 1
+
+
 class SmartXML:
-    def __init__(self, data: Path = None):
+    def __init__(
+        self,
+        data: Path = None,
+        find_cache_size: int = 128,
+        name_summaries: bool = False,
+        reference_source: bool = False,
+        pause_gc: bool = None,
+        freeze_gc: bool = False,
+        trace_memory: bool = False,
+        parse_stats: bool = False,
+        limits: Limits = None,
+    ):
+        """
+        :param data: Path to an XML file to read
+        :param find_cache_size: how many find() results to keep for repeated queries, 0 disables the cache
+        :param name_summaries: keep a summary of the names in each subtree, so searches can skip subtrees
+                that can not contain the requested name. Costs an extra pass on read and some memory.
+        :param reference_source: text, comment and CDATA elements reference the read text instead of keeping
+                their own copy, which saves memory on big texts (e.g. embedded binary data) while the text is alive.
+        :param pause_gc: pause the cyclic garbage collector while building the tree, as the parent <-> sons links
+                make every element a part of a cycle it would scan over and over.
+                None (default) pauses it only for big texts (from 1M characters).
+        :param freeze_gc: move all objects (the new tree included) to the permanent generation after reading
+                (see gc.freeze()), so later collections do not scan the tree.
+                This is process wide: the objects of the whole program are frozen too, and frozen objects are
+                never collected, even once the tree is dropped, until unfreeze_gc() is called.
+        :param trace_memory: measure the memory allocated while reading, with tracemalloc, see memory_stats()
+        :param parse_stats: collect counters and timings while reading, see the parse_stats property
+        :param limits: limits on the XML to read, exceeding them raises LimitExceeded (a BadXMLFormat)
+        """
         self._file_name = data
         self._declaration = ""
         self._tree = None
         self._doctype = None
+        self._version = 0
+        self._structure_epoch = StructureEpoch()
+        self._path_epoch = StructureEpoch()
+        self._find_cache = OrderedDict()
+        self._find_cache_version = 0
+        self._find_cache_size = find_cache_size
+        self._name_summaries = name_summaries
+        self._outdated_summaries = {}  # id -> element whose names summary may keep removed names
+        self._reference_source = reference_source
+        self._pause_gc = pause_gc
+        self._freeze_gc = freeze_gc
+        self._trace_memory = trace_memory
+        self._read_memory = None  # (allocated, peak) bytes of the last read, if traced
+        self._collect_parse_stats = parse_stats
+        self._parse_stats = None
+        self._limits = limits
+        self._order_stamp = None
+        self._order_version = -1
+        self._subscribers = []
+        self._observing = None  # finalizer that stops counting this document in ElementBase._observed
+        self._batch = None  # the active Batch of this tree, see batch()
         if self._file_name:
             self.read(self._file_name)
 
@@ -277,47 +746,131 @@ class SmartXML:
         """Get the root element of the XML tree."""
         return self._tree
 
+    @property
+    def version(self) -> int:
+        """Get the modification counter of the XML tree, it changes whenever the tree is modified."""
+        return self._version
+
+    def _structure_changed(self):
+        """Outdate the depth and path memos of all the elements, see ElementBase._update_position()."""
+        self._structure_epoch.current = False
+        self._structure_epoch = StructureEpoch()
+        self._names_changed()
+
+    def _refresh_summaries(self):
+        """Recalculate the names summaries outdated by removals, see ElementBase._outdate_summary()."""
+        outdated = [element for element in self._outdated_summaries.values() if element._owner is self]
+        self._outdated_summaries = {}
+        for element in sorted(outdated, key=ElementBase.get_depth, reverse=True):  # sons before their parents
+            element._refresh_summary()
+
+    def _names_changed(self):
+        """Outdate the path memos of all the elements, see ElementBase.get_path()."""
+        self._path_epoch.current = False
+        self._path_epoch = StructureEpoch()
+
+    @property
+    def parse_stats(self) -> ParseStats | None:
+        """Get the counters and timings of the last read, None unless the parse_stats option was given."""
+        return self._parse_stats
+
     @property
     def declaration(self) -> str:
         """Get the XML declaration."""
         return self._declaration
 
-    def _parse_declaration(self, file_content: str):
-        start = file_content.find("<?xml")
-        end = file_content.find("?>", start)
-        if (start >= 0 and end == -1) or (start == -1 and end > 0):
-            raise BadXMLFormat("Malformed XML declaration")
-        if start > 0:
-            raise BadXMLFormat("XML declaration must be at the beginning of the file")
-        if start >= 0 and end >= 0:
-            declaration = file_content[start + 5 : end].strip()
-            self._declaration = declaration
-            file_content = file_content[end + 2 :]
-
-        return file_content
-
-    def read(self, file_name: Path) -> None:
+    def read(
+        self,
+        file_name: Path,
+        progress: Callable[[int, int], None] = None,
+        cancel_token: CancellationToken = None,
+        progress_step: int = _PROGRESS_STEP,
+    ) -> None:
         """
         Read and parse the XML file into an element tree.
         :param file_name: Path to the XML file
+        :param progress: called with (bytes_done, bytes_total) while the file is parsed
+        :param cancel_token: stops the read when cancelled
+        :param progress_step: bytes between calls of progress
         :raises:
             TypeError: if file_name is not a pathlib.Path object
             FileNotFoundError: if file_name does not exist
             BadXMLFormat: if the XML format is invalid
+            LimitExceeded: if the XML exceeds the limits given to SmartXML
+            OperationCancelled: if cancel_token was cancelled
         """
         if not isinstance(file_name, Path):
             raise TypeError("file_name must be a pathlib.Path object")
         if not file_name.exists():
             raise FileNotFoundError(f"File {file_name} does not exist")
+        if self._limits is not None:
+            self._limits._check_size(file_name.stat().st_size)  # before reading it all to memory
+        if cancel_token is not None:
+            cancel_token._check()
 
         self._file_name = file_name
         file_content = self._file_name.read_text()
-        self._read_xml(file_content)
-
-    def _read_xml(self, text: str):
-        text = self._parse_declaration(text)
-        elements = _read_elements(text)
+        tracker = None
+        if progress is not None or cancel_token is not None:
+            tracker = _Progress(progress, cancel_token, progress_step, file_name.stat().st_size, len(file_content))
+        self._read_xml(file_content, tracker)
+
+    def _read_xml(self, text: str, progress: _Progress = None):
+        if self._limits is not None:
+            self._limits._check_text(text)
+        pause_gc = self._pause_gc if self._pause_gc is not None else len(text) >= _PAUSE_GC_MIN_SIZE
+        resume_gc = pause_gc and gc.isenabled()
+        if resume_gc:
+            gc.disable()
+        try:
+            if self._trace_memory:
+                self._build_tree_traced(text, progress)
+            else:
+                self._build_tree(text, progress)
+        finally:
+            if resume_gc:
+                gc.enable()
+        if self._freeze_gc:
+            gc.freeze()
+
+    @staticmethod
+    def unfreeze_gc():
+        """
+        Move the objects frozen by the freeze_gc option back to the oldest generation (see gc.unfreeze()),
+        e.g. after dropping a frozen tree, so its cycles can be collected.
+        This is process wide, it unfreezes the objects frozen by any document, or by any other code.
+        """
+        gc.unfreeze()
+
+    def _build_tree_traced(self, text: str, progress: _Progress = None):
+        stop_tracing = not tracemalloc.is_tracing()
+        if stop_tracing:
+            tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            self._build_tree(text, progress)
+            after, peak = tracemalloc.get_traced_memory()
+            self._read_memory = (after - before, peak - before)
+        finally:
+            if stop_tracing:
+                tracemalloc.stop()
+
+    def _build_tree(self, text: str, progress: _Progress = None):
+        stats = ParseStats() if self._collect_parse_stats else None
+        start_time = time.perf_counter()
+        if stats is not None:
+            stats.bytes = _utf8_size(text)
+        length = len(text)
+        declaration, text = _parse_declaration(text)
+        if declaration is not None:
+            self._declaration = declaration
+        if progress is not None:
+            progress.offset = length - len(text)
+        limits = _LimitsCheck(self._limits) if self._limits is not None else None
+        elements = _read_elements(text, self._reference_source, stats, limits, progress)
 
+        previous = self._tree
         if len(elements) == 1:
             self._tree = elements[0]
         elif len(elements) == 2 and isinstance(elements[0], Doctype) and isinstance(elements[1], Element):
@@ -325,16 +878,104 @@ class SmartXML:
             self._tree = elements[1]
         else:
             raise BadXMLFormat("xml contains more than one outer element")
-
-    def write(self, file_name: Path = None, indentation: str = "\t") -> str | None:
+        if previous is not None:
+            previous._set_owner(None)
+        self._tree._set_owner(self)
+        self._outdated_summaries = {}
+        if self._name_summaries:
+            self._tree._build_summary()
+        self._version += 1
+        self._structure_changed()  # the elements of a previous tree are not a part of this document anymore
+        if stats is not None:
+            stats.seconds["total"] = time.perf_counter() - start_time
+            stats.seconds["build"] = stats.seconds["total"] - stats.seconds.get("tokenize", 0.0)
+            stats._count_elements(elements)
+            self._parse_stats = stats
+
+    def memory_stats(self) -> dict[str, int | dict[str, int]]:
+        """
+        Estimate the memory the XML tree keeps, by walking over it.
+        Strings shared by several elements (e.g. the same name, or the source text of reference_source) count once.
+        :return: a dict of
+            nodes: number of elements, by class name
+            nodes_bytes: the element objects, their attribute dicts and their sons lists
+            sons_over_allocation_bytes: the part of nodes_bytes spent on unused room in the sons lists
+            names_bytes, attributes_bytes, text_bytes: the names, the attributes (parsed or not) and the texts
+            caches_bytes: memoized contents and paths, that are not the text of a son as is
+            total_bytes: the sum of all the above, except sons_over_allocation_bytes that is already in nodes_bytes
+            read_allocated_bytes, read_peak_bytes: if trace_memory was given, the memory allocated by the last read,
+                and the peak while reading, as measured by tracemalloc
+        """
+        pointer_size = struct.calcsize("P")
+        empty_list_size = sys.getsizeof([])
+        counted = set()  # ids of the strings already counted
+
+        def size_once(obj) -> int:
+            if obj is None or id(obj) in counted:
+                return 0
+            counted.add(id(obj))
+            return sys.getsizeof(obj)
+
+        nodes = {}
+        contents = []
+        stats = dict.fromkeys(
+            ["nodes_bytes", "sons_over_allocation_bytes", "names_bytes", "attributes_bytes", "text_bytes", "caches_bytes"],
+            0,
+        )
+        roots = [self._doctype, self._tree] if self._doctype else [self._tree]
+        for root in roots:
+            for element in root._iter_tree():
+                class_name = type(element).__name__
+                nodes[class_name] = nodes.get(class_name, 0) + 1
+                state = element.__dict__
+                sons = element._sons
+                stats["nodes_bytes"] += sys.getsizeof(element) + sys.getsizeof(state) + sys.getsizeof(sons)
+                stats["sons_over_allocation_bytes"] += sys.getsizeof(sons) - empty_list_size - len(sons) * pointer_size
+                stats["names_bytes"] += size_once(element._name)
+
+                attributes = state.get("_attributes")
+                if attributes is not None:
+                    stats["attributes_bytes"] += sys.getsizeof(attributes)
+                    for key, value in attributes.items():
+                        stats["attributes_bytes"] += size_once(key) + size_once(value)
+                else:
+                    stats["attributes_bytes"] += size_once(state.get("_raw_attributes"))
+
+                stats["text_bytes"] += size_once(state.get("_source", state.get("_text")))
+                if "_content" in state:
+                    contents.append(state["_content"])
+                if "_path" in state:
+                    contents.append(state["_path"])
+
+        # after all the texts, as the content of an element with a single text son is that text itself
+        stats["caches_bytes"] = sum(size_once(content) for content in contents)
+        stats["total_bytes"] = sum(value for key, value in stats.items() if key != "sons_over_allocation_bytes")
+        stats["nodes"] = nodes
+        if self._read_memory is not None:
+            stats["read_allocated_bytes"], stats["read_peak_bytes"] = self._read_memory
+        return stats
+
+    def write(
+        self,
+        file_name: Path = None,
+        indentation: str = "\t",
+        progress: Callable[[int, int], None] = None,
+        cancel_token: CancellationToken = None,
+        progress_step: int = _PROGRESS_STEP,
+    ) -> str | None:
         """Write the XML tree back to the file.
+        The file is written to a temporary file first, which replaces it only when the writing is done.
         :param file_name: Path to the XML file, if None, overwrite the original file
         :param indentation: string used for indentation, default is tab character
+        :param progress: called with (bytes_done, bytes_total) while the file is written
+        :param cancel_token: stops the write when cancelled, the file is left as it was
+        :param progress_step: bytes between calls of progress
         :return: XML string if file_name is None, else None
         :raises:
             ValueError: if file name is not specified
             TypeError: if file_name is not a pathlib.Path object
             FileNotFoundError: if file_name does not exist
+            OperationCancelled: if cancel_token was cancelled
         """
         if not file_name:
             file_name = self._file_name
@@ -343,10 +984,35 @@ class SmartXML:
 
         tmp_file = file_name.resolve().with_name(file_name.name + ".tmp")
 
-        result = self.to_string(indentation=indentation)  # , preserve_format=preserve_format)
-        with open(tmp_file, "w", encoding="utf-8") as file:
-            file.write(result)
-        os.replace(tmp_file, file_name)
+        tracked = progress is not None or cancel_token is not None
+        if not tracked:
+            result = self.to_string(indentation=indentation)  # , preserve_format=preserve_format)
+        else:
+            result = self._to_string(indentation, cancel_token._check if cancel_token is not None else None)
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as file:
+                if not tracked:
+                    file.write(result)
+                else:
+                    tracker = _Progress(progress, cancel_token, progress_step, _utf8_size(result))
+                    self._write_in_steps(file, result, tracker)
+            os.replace(tmp_file, file_name)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)  # the original file is left as it was
+            raise
+
+    @staticmethod
+    def _write_in_steps(file, text: str, progress: _Progress):
+        is_ascii = text.isascii()
+        bytes_done = 0
+        start = 0
+        while start < len(text):
+            progress.reached(bytes_done)
+            part = text[start : start + progress.interval]
+            file.write(part)
+            bytes_done += len(part) if is_ascii else len(part.encode("utf-8"))
+            start += len(part)
+        progress.reached(bytes_done)
 
     def to_string(self, indentation: str = "\t") -> str:
         """
@@ -354,15 +1020,84 @@ class SmartXML:
         :param indentation: string used for indentation, default is tab character
         :return: XML string
         """
+        return self._to_string(indentation)
+
+    def _to_string(self, indentation: str, check: Callable[[], None] = None) -> str:
+        """
+        Convert the XML tree to a string.
+        :param check: if given, called every few hundred elements, e.g. to stop a cancelled write
+        """
         result = ""
         if self._declaration:
             result = f"<?xml {self._declaration}?>\n"
         if self._doctype:
             result = result + self._doctype.to_string(indentation)
 
-        result = result + self._tree.to_string(indentation)
+        if check is None:
+            result = result + self._tree.to_string(indentation)
+        else:
+            result = result + self._tree._write(0, indentation, check)
         return result
 
+    def subscribe(self, callback: Callable[[Event], None]):
+        """
+        Call the callback on every change of the XML tree: insert, remove, rename, content_change
+        (of a text, comment or CDATA element), attribute_change (by the attributes setter), comment_out and uncomment.
+        Changes made inside batch() are passed on when the batch ends, and not at all if it is rolled back.
+        :param callback: called with an Event, after the change was made
+        """
+        if not self._subscribers:
+            ElementBase._observed += 1
+            self._observing = weakref.finalize(self, _stop_observing)  # also if the document is dropped subscribed
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Event], None]):
+        """
+        Stop calling a callback given to subscribe()
+        :raises:
+            ValueError: if the callback is not subscribed
+        """
+        self._subscribers.remove(callback)
+        if not self._subscribers:
+            self._observing()
+
+    def _notify(self, event: Event):
+        for callback in list(self._subscribers):  # a callback may unsubscribe
+            callback(event)
+
+    @contextmanager
+    def batch(self):
+        """
+        Group many changes, so the derived data (name summaries, comment counters, caches)
+        is brought up to date once, when the block ends, instead of on every single change.
+        If an exception escapes the block, all the changes made inside it are rolled back.
+        Only the changes to this tree are a part of the batch, including elements taken out of it or put into it
+        inside the block. Other trees are changed as usual, with their own caches.
+        A nested batch() of this tree is a part of the enclosing one.
+
+        Usage:
+            with xml.batch():
+                for element in xml.find("item", only_one=False):
+                    element.name = "product"
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        batch = Batch()
+        self._batch = batch
+        ElementBase._batches.append(batch)
+        try:
+            yield
+        except BaseException:
+            self._batch = None
+            ElementBase._batches.remove(batch)
+            batch.rollback()
+            raise
+        self._batch = None
+        ElementBase._batches.remove(batch)
+        batch.commit()
+
     def find(
         self, name: str = "", only_one: bool = True, with_content: str = None, case_sensitive: bool = True
     ) -> Element | list[Element] | None:
@@ -381,4 +1116,428 @@ class SmartXML:
         """
         if not name and with_content is None:
             raise ValueError("At least one search criteria must be provided")
-        return self._tree.find(name, only_one, with_content, case_sensitive)
+        if not self._find_cache_size or self._batch is not None:
+            return self._tree.find(name, only_one, with_content, case_sensitive)
+
+        if self._find_cache_version != self._version:
+            self._find_cache.clear()
+            self._find_cache_version = self._version
+
+        key = (name, only_one, with_content, case_sensitive)
+        if key in self._find_cache:
+            self._find_cache.move_to_end(key)
+            result = self._find_cache[key]
+        else:
+            result = self._tree.find(name, only_one, with_content, case_sensitive)
+            self._find_cache[key] = result
+            if len(self._find_cache) > self._find_cache_size:
+                self._find_cache.popitem(last=False)
+
+        if isinstance(result, list):
+            return list(result)  # the caller may change the list
+        return result
+
+    def explain(
+        self, name: str = "", only_one: bool = True, with_content: str = None, case_sensitive: bool = True
+    ) -> dict:
+        """
+        Run a search, as find() does but without its cache, and report how it went
+        :param name, only_one, with_content, case_sensitive: as in find()
+        :return: a dict of
+            strategy: how the search was done
+            nodes_visited, name_comparisons, content_evaluations: the work the search did
+            results: number of elements found
+            seconds: the time the search took (with the counting, so somewhat longer than it takes alone)
+        :raises:
+            ValueError: if neither name nor with_content is provided
+        """
+        if not name and with_content is None:
+            raise ValueError("At least one search criteria must be provided")
+
+        strategy = ["stop at the first match" if only_one else "full traversal"]
+        names_list = name.split("|")
+        if self._tree._summary is not None and (_name_bit(name) | _name_bit(names_list[0])):
+            if self._batch is None:
+                strategy.append("skip subtrees by names summaries")
+            else:
+                strategy.append("names summaries are not used inside a batch")
+        if len(names_list) > 1:
+            strategy.append(f"match the path from its first name, {names_list[0]!r}")
+        key = (name, only_one, with_content, case_sensitive)
+        if self._find_cache_size and self._find_cache_version == self._version and key in self._find_cache:
+            strategy.append("find() would return the cached result")
+
+        counters = profiling.QueryCounters()
+        profiling._start_counting(counters)
+        try:
+            result = self._tree.find(name, only_one, with_content, case_sensitive)
+        finally:
+            profiling._stop_counting(counters)
+
+        if isinstance(result, list):
+            results = len(result)
+        else:
+            results = 0 if result is None else 1
+        return {
+            "strategy": strategy,
+            "nodes_visited": counters.nodes_visited,
+            "name_comparisons": counters.name_comparisons,
+            "content_evaluations": counters.content_evaluations,
+            "results": results,
+            "seconds": counters.seconds,
+        }
+
+    def find_many(self, queries: dict[str, str | dict]) -> dict[str, Element | list[Element] | None]:
+        """
+        Run several finds in a single traversal of the XML tree
+        :param queries: label -> query, a query is either a name (as in find) or a dict of find() arguments,
+                e.g. {"bob": {"name": "firstName", "with_content": "Bob"}, "students": "students|student"}
+        :return: label -> result, each result is the same as the matching find() would return
+        :raises:
+            ValueError: if a query has neither name nor with_content
+            TypeError: if a query is neither a string nor a dict
+        """
+        find_queries = {}
+        for label, query in queries.items():
+            if isinstance(query, str):
+                find_queries[label] = FindQuery(query)
+            elif isinstance(query, dict):
+                find_queries[label] = FindQuery(**query)
+            else:
+                raise TypeError(f"Query {label} must be a string or a dict of find() arguments")
+
+        self._tree._find_many(list(find_queries.values()))
+        return {label: query.result for label, query in find_queries.items()}
+
+    def _number_tree(self):
+        """
+        Give every node a pre-order and a post-order number (in a single Euler tour counter),
+        so ancestry and document order can be checked in constant time.
+        The numbering is done lazily, on first use after the tree was modified.
+        """
+        if self._order_version == self._version and self._batch is None:
+            return
+
+        order_stamp = object()
+        counter = 0
+        stack = [(self._tree, False)]
+        while stack:
+            element, visited = stack.pop()
+            if visited:
+                element._post = counter
+            else:
+                element._pre = counter
+                element._order_stamp = order_stamp
+                stack.append((element, True))
+                stack.extend((son, False) for son in reversed(element._sons))
+            counter += 1
+
+        self._order_stamp = order_stamp
+        self._order_version = self._version
+
+    def _check_numbered(self, *elements: ElementBase):
+        self._number_tree()
+        for element in elements:
+            if element._order_stamp is not self._order_stamp:
+                raise ValueError(f"Element {element!r} is not a part of this XML tree")
+
+    def is_ancestor_of(self, ancestor: ElementBase, element: ElementBase) -> bool:
+        """
+        Check whether an element is nested (at any level) inside another one
+        :param ancestor: the containing element
+        :param element: the contained element
+        :return: True if ancestor contains element, False otherwise (and if they are the same element)
+        :raises:
+            ValueError: if any of the elements is not a part of this XML tree
+        """
+        self._check_numbered(ancestor, element)
+        return ancestor._pre < element._pre and element._post < ancestor._post
+
+    def compare_document_order(self, first: ElementBase, second: ElementBase) -> int:
+        """
+        Compare the position of two elements in the document
+        :return: -1 if first comes before second, 1 if it comes after, 0 if they are the same element
+        :raises:
+            ValueError: if any of the elements is not a part of this XML tree
+        """
+        self._check_numbered(first, second)
+        if first._pre < second._pre:
+            return -1
+        if first._pre > second._pre:
+            return 1
+        return 0
+
+    def sort_in_document_order(self, elements: list[ElementBase], remove_duplicates: bool = False) -> list[ElementBase]:
+        """
+        Sort elements by their position in the document, e.g. to merge results of several find() calls
+        :param elements: elements of this XML tree
+        :param remove_duplicates: keep only one occurrence of each element
+        :return: a new sorted list
+        :raises:
+            ValueError: if any of the elements is not a part of this XML tree
+        """
+        self._check_numbered(*elements)
+        if remove_duplicates:
+            elements = {id(element): element for element in elements}.values()
+        return sorted(elements, key=lambda element: element._pre)
+
+
+class _OpenElement:
+    """An element whose closing tag was not read yet, as tracked by _FileSearch."""
+
+    __slots__ = ("element", "depth", "candidate", "target", "needs_sons", "held")
+
+    def __init__(self, element: ElementBase, depth: int, candidate: bool, target: bool, in_reach: bool):
+        self.element = element
+        self.depth = depth
+        self.candidate = candidate  # may be the first element of a match, see _FileSearch._is_candidate()
+        self.target = target  # may be a result, so all its descendants are kept
+        self.needs_sons = in_reach or candidate or target  # its text is kept, for the content of a match
+        self.held = []  # of a candidate, the results found below it, that come after its own in document order
+
+
+class _FileSearch:
+    """
+    The state of find_in_file(): builds the elements from the tokens, and keeps only the open elements and
+    the parts of the tree that the open candidates need, to match them with the find() rules when they are closed.
+    """
+
+    def __init__(self, names: str, only_one: bool, with_content: str, case_sensitive: bool):
+        self._names = names
+        self._names_list = names.split("|")
+        self._only_one = only_one
+        self._with_content = with_content
+        self._case_sensitive = case_sensitive
+        # the names that _check_name_match() accepts, None for any name
+        self._candidate_names = self._match_names({names, self._names_list[0]}) if names else None
+        self._target_names = self._match_names({names, self._names_list[-1]}) if names else None
+
+    def _match_names(self, names: set[str]) -> frozenset[str]:
+        return frozenset(names if self._case_sensitive else (name.casefold() for name in names))
+
+    def _name_in(self, element: ElementBase, names: frozenset[str] | None) -> bool:
+        if names is None:
+            return True
+        name = element._name_for_match()
+        return (name if self._case_sensitive else name.casefold()) in names
+
+    def _is_candidate(self, element: ElementBase) -> bool:
+        """Whether element._find_one_here() / element._find_all_here() may find anything."""
+        return self._name_in(element, self._candidate_names)
+
+    def _is_target(self, element: ElementBase) -> bool:
+        return self._name_in(element, self._target_names)
+
+    def _results(self, element: ElementBase) -> list[ElementBase]:
+        """The results of a closed candidate, as find() would find them, from the same element."""
+        if self._only_one:
+            found = element._find_one_here(self._names, self._names_list, self._with_content, self._case_sensitive)
+            return [found] if found is not None else []
+        return element._find_all_here(self._names, self._names_list, self._with_content, self._case_sensitive)
+
+    def _subtree_results(self, element: ElementBase) -> list[ElementBase]:
+        """The results of an element read with all its descendants at once, e.g. a commented out element."""
+        if self._only_one:
+            found = element._find_one(self._names, self._with_content, self._case_sensitive)
+            return [found] if found is not None else []
+        return element._find_all(self._names, self._with_content, self._case_sensitive)
+
+    def run(self, text: str):
+        """Generate the results, in document order, while reading the text."""
+        open_elements: list[_OpenElement] = []
+        incomplete_nodes = []  # the elements of open_elements, for _add_ready_token()
+        ready_nodes = {}
+        candidates: list[_OpenElement] = []  # the open candidates, results found below them wait in the innermost
+        open_targets = 0
+        reach = len(self._names_list) - 1  # how deep below a candidate its match may be
+        outer_elements = 0
+        in_doctype = False
+        text_candidate = self._is_candidate(ContentOnly(""))  # text has no name, it matches only a content search
+
+        def close(element: ElementBase, depth: int, results: list[ElementBase], keep: bool) -> list[ElementBase]:
+            """Keep a closed element if an open element needs it, and get its results to pass on now."""
+            nonlocal outer_elements
+            if not depth:
+                outer_elements += 1
+                if outer_elements > 1:
+                    raise BadXMLFormat("xml contains more than one outer element")
+                return results
+            if keep:
+                _add_ready_token(incomplete_nodes, ready_nodes, element, depth)
+            if candidates and results:
+                candidates[-1].held.extend(results)  # an open candidate above comes first in document order
+                return []
+            return results
+
+        _, text = _parse_declaration(text)
+        for token in _divide_to_tokens(text):
+            token_type = token.token_type
+            if in_doctype:
+                if token_type == TokenType.closing:
+                    open_elements.pop()
+                    incomplete_nodes.pop()
+                    in_doctype = False
+                continue  # the DOCTYPE is not searched, as find() does not search it
+
+            data = token.data
+            depth = len(open_elements)
+            # whether the element of this token is a part of the subtree an open candidate or target needs
+            in_reach = open_targets > 0 or (bool(candidates) and depth - candidates[-1].depth <= reach)
+
+            if token_type == TokenType.full_tag_name:
+                if data.endswith("/"):
+                    element = _parse_element(data[:-1])
+                    element._is_empty = True
+                    results = self._results(element) if self._is_candidate(element) else []
+                    results = close(element, depth, results, in_reach)
+
+                elif data.startswith("/"):
+                    data = data[1:].strip()
+                    if not open_elements:
+                        raise BadXMLFormat(f"Closing tag without opening tag: {data}, in line {token.line_number}")
+                    entry = open_elements[-1]
+                    if entry.element.name != data:
+                        raise BadXMLFormat(
+                            f"Mismatched XML tags, opening: {entry.element.name}, closing: {data}, "
+                            f"in line {token.line_number}"
+                        )
+                    results = self._close_entry(open_elements, incomplete_nodes, candidates)
+                    if entry.target:
+                        open_targets -= 1
+                    depth -= 1
+                    in_reach = open_targets > 0 or (bool(candidates) and depth - candidates[-1].depth <= reach)
+                    results = close(entry.element, depth, results, in_reach)
+
+                else:
+                    element = _parse_element(data)
+                    entry = _OpenElement(element, depth, self._is_candidate(element), self._is_target(element), in_reach)
+                    open_elements.append(entry)
+                    incomplete_nodes.append(element)
+                    if entry.candidate:
+                        candidates.append(entry)
+                    if entry.target:
+                        open_targets += 1
+                    continue
+
+            elif token_type == TokenType.closing:
+                entry = open_elements[-1]
+                results = self._close_entry(open_elements, incomplete_nodes, candidates)
+                if entry.target:
+                    open_targets -= 1
+                depth -= 1
+                in_reach = open_targets > 0 or (bool(candidates) and depth - candidates[-1].depth <= reach)
+                results = close(entry.element, depth, results, in_reach)
+
+            elif token_type == TokenType.content:
+                keep = in_reach or (depth > 0 and open_elements[-1].needs_sons)
+                if not (keep or text_candidate or not depth):
+                    continue  # neither a match, nor a part of one
+                lines = data.splitlines()
+                if len(lines) == 1:
+                    content_only = ContentOnly(data)
+                else:
+                    content_only = ContentLines("\n".join(line.strip() for line in lines))
+                results = self._results(content_only) if text_candidate else []
+                results = close(content_only, depth, results, keep)
+
+            elif token_type == TokenType.comment:
+                elements = _read_comment(data, False)
+                if elements is None:
+                    comment = TextOnlyComment(data)
+                    results = self._results(comment) if self._is_candidate(comment) else []
+                    results = close(comment, depth, results, in_reach)
+                else:
+                    results = []
+                    for element in elements:
+                        results.extend(close(element, depth, self._subtree_results(element), in_reach))
+
+            elif token_type == TokenType.c_data:
+                element = CData(data)
+                results = self._results(element) if self._is_candidate(element) else []
+                results = close(element, depth, results, in_reach)
+
+            elif token_type == TokenType.doctype:
+                open_elements.append(_OpenElement(Doctype(data), depth, False, False, False))
+                incomplete_nodes.append(open_elements[-1].element)
+                in_doctype = True
+                continue
+
+            else:
+                continue
+
+            if results:
+                yield from results
+
+        if open_elements:
+            raise BadXMLFormat(f"Unclosed tag: {open_elements[-1].element.name}")
+
+    def _close_entry(
+        self, open_elements: list[_OpenElement], incomplete_nodes: list, candidates: list[_OpenElement]
+    ) -> list[ElementBase]:
+        """Close the innermost open element, and get its results, with the results held for it."""
+        entry = open_elements.pop()
+        incomplete_nodes.pop()
+        if not entry.candidate:
+            return []
+        candidates.pop()
+        results = self._results(entry.element)
+        results.extend(entry.held)
+        return results
+
+
+def _run_with_gc_paused(generator: Iterator) -> Iterator:
+    """Run the generator with the cyclic garbage collector paused, like a read, but not the code using its items."""
+    while True:
+        resume_gc = gc.isenabled()
+        gc.disable()
+        try:
+            item = next(generator)
+        except StopIteration:
+            return
+        finally:
+            if resume_gc:
+                gc.enable()
+        yield item
+
+
+def find_in_file(
+    file_name: Path, name: str = "", only_one: bool = True, with_content: str = None, case_sensitive: bool = True
+) -> ElementBase | Iterator[ElementBase] | None:
+    """
+    Find element(s) in an XML file, like SmartXML.find(), without reading the whole file into a tree.
+    Only the open elements, and the parts of the tree a match may need, are kept while the file is parsed,
+    and the parsing stops at the first match, so the time depends on where the match is, not on the file size.
+    The part of the file after the match is not checked, so a malformed file may still have a match.
+    :param file_name: Path to the XML file
+    :param name: name of the element to find, can be nested using |, e.g. "parent|child|subchild"
+    :param only_one: stop at first find, or generate all found elements, in document order, while parsing
+    :param with_content: filter by content
+    :param case_sensitive: whether the search is case-sensitive, default is True
+    :return: the element found, or None, if only_one is True, else an iterator of the elements found.
+            The elements are complete, but are not a part of a document, and their ancestors are only partly read
+    :raises:
+        ValueError: if neither name nor with_content is provided
+        TypeError: if file_name is not a pathlib.Path object
+        FileNotFoundError: if file_name does not exist
+        BadXMLFormat: if the XML format is invalid, up to the match
+    """
+    if not name and with_content is None:
+        raise ValueError("At least one search criteria must be provided")
+    if not isinstance(file_name, Path):
+        raise TypeError("file_name must be a pathlib.Path object")
+    if not file_name.exists():
+        raise FileNotFoundError(f"File {file_name} does not exist")
+
+    text = file_name.read_text()
+    found = _FileSearch(name, only_one, with_content, case_sensitive).run(text)
+    if len(text) >= _PAUSE_GC_MIN_SIZE:
+        found = _run_with_gc_paused(found)
+    if only_one:
+        return next(found, None)
+    return found
+
+
+if os.environ.get("SMARTXML_PROFILE", "0") not in ("", "0"):
+    profiling.enable(report_at_exit=True)
+if os.environ.get("SMARTXML_QUERY_COUNTERS", "0") not in ("", "0"):
+    profiling.enable_query_counters(report_at_exit=True)
@@ -0,0 +1,62 @@
+"""
+Worst-case input shapes, each with the work to do on it and its budgets.
+test_pathological.py checks that the work grows linearly with the size, and stays within the budgets.
+"""
+
+from smartXML.xmltree import SmartXML
+
+
+class Case:
+    def __init__(self, build, size: int, seconds: float, bytes_per_character: int, indentation: str = "\t"):
+        """
+        :param build: build(size) returns the text of the document
+        :param size: the base size, the work is timed on this size and on 4 times this size
+        :param seconds: time budget of the work on 4 times the base size
+        :param bytes_per_character: budget of the peak memory of the work, per character of the text
+        :param indentation: used for writing, deep trees are written without indentation, as the indentation
+                alone grows with the square of the depth
+        """
+        self.build = build
+        self.size = size
+        self.seconds = seconds
+        self.bytes_per_character = bytes_per_character
+        self.indentation = indentation
+
+    def work(self, text: str):
+        xml = SmartXML(find_cache_size=0)
+        xml._read_xml(text)
+        xml.to_string(self.indentation)
+        xml.find("missing")
+        xml.tree.clone()
+        xml.find("item", only_one=False)[-1].comment_out()
+
+
+def markup_comments(size: int) -> str:
+    """Comments that look like markup, but can not be parsed, so each one is parsed twice."""
+    return "<root>\n" + "".join(f"<!-- <a{index}><b>text {index}</b> -->\n<item/>\n" for index in range(size)) + "</root>"
+
+
+def text_comments(size: int) -> str:
+    return "<root>\n" + "".join(f"<!-- just a note, number {index} -->\n<item/>\n" for index in range(size)) + "</root>"
+
+
+def long_line(size: int) -> str:
+    return "<root><item>" + "lorem ipsum dolor sit amet " * (size // 27) + "</item></root>"
+
+
+def many_siblings(size: int) -> str:
+    """Text and elements of the same parent, mixed."""
+    return "<root>\n" + "".join(f"text {index}\n<item/>\n" for index in range(size)) + "</root>"
+
+
+def deep_nesting(size: int) -> str:
+    return "<item>" * size + "text" + "</item>" * size
+
+
+CASES = {
+    "markup_comments": Case(markup_comments, 2_000, seconds=3.0, bytes_per_character=50),
+    "text_comments": Case(text_comments, 2_000, seconds=2.0, bytes_per_character=50),
+    "long_line": Case(long_line, 2_000_000, seconds=1.0, bytes_per_character=10),
+    "many_siblings": Case(many_siblings, 2_000, seconds=1.5, bytes_per_character=120),
+    "deep_nesting": Case(deep_nesting, 2_000, seconds=1.5, bytes_per_character=250, indentation=""),
+}
@@ -1,10 +1,33 @@
 import argparse
+import gc
 import shutil
+import time
 import textwrap
 from readme_example import test_readme_example
 
-from smartXML.xmltree import SmartXML, BadXMLFormat, _read_elements, _parse_element
-from smartXML.element import Element, TextOnlyComment, ContentOnly, IllegalOperation
+import smartXML
+from smartXML import profiling
+from smartXML.xmltree import (
+    SmartXML,
+    BadXMLFormat,
+    CancellationToken,
+    LimitExceeded,
+    Limits,
+    OperationCancelled,
+    _LimitsCheck,
+    _read_elements,
+    _parse_element,
+)
+from smartXML.element import (
+    Element,
+    ElementBase,
+    TextOnlyComment,
+    ContentOnly,
+    CData,
+    IllegalOperation,
+    EventType,
+    _name_bit,
+)
 from pathlib import Path
 import pytest
 import random
@@ -19,6 +42,7 @@ def _test_tree_integrity(xml_tree: SmartXML):
             assert (
                 son._parent == element
             ), f"Element {son.name} has incorrect parent {son._parent.name if son._parent else 'None'}, expected {element.name}"
+            assert son._owner is element._owner, f"Element {son.name} is not kept as a part of its parent's document"
             full_name = name + "|" + son.name
             assert full_name == son.get_path()
             found = xml.find(full_name, False)
@@ -2275,6 +2299,1163 @@ def test_find_content():
     assert a.content == "ABC\nNew Content"
 
 
+def test_find_many():
+    src = textwrap.dedent("""\
+        <root>
+            <A id="1">
+                <B>b1</B>
+                <B>
+                    <C id="1">c</C>
+                </B>
+                <A id="2">
+                    <B>
+                        <C id="2">C</C>
+                    </B>
+                </A>
+            </A>
+            <!--ABC-->
+            <X>
+                <A id="3">
+                    <B>
+                        <C id="3">c</C>
+                    </B>
+                </A>
+            </X>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+
+    queries = {
+        "a": "A",
+        "all_a": {"name": "A", "only_one": False},
+        "abc": {"name": "A|B|C", "only_one": False},
+        "c": {"name": "C", "with_content": "C", "case_sensitive": False, "only_one": False},
+        "content": {"with_content": "b1"},
+        "comment": "ABC",
+        "missing": "Dccc",
+        "all_missing": {"name": "Dccc", "only_one": False},
+    }
+    results = xml.find_many(queries)
+
+    assert results.keys() == queries.keys()
+    for label, query in queries.items():
+        if isinstance(query, str):
+            assert results[label] == xml.find(query)
+        else:
+            assert results[label] == xml.find(**query)
+
+    assert results["missing"] is None
+    assert results["all_missing"] == []
+    assert len(results["abc"]) == 3
+
+    with pytest.raises(ValueError):
+        xml.find_many({"bad": {"only_one": False}})
+
+    with pytest.raises(TypeError):
+        xml.find_many({"bad": 12})
+
+
+def test_find_cache():
+    file_name = __create_file("<A><B>b</B><C><B>bb</B></C></A>")
+    xml = SmartXML(file_name)
+
+    version = xml.version
+    b = xml.find("B")
+    assert xml.find("B") is b
+    all_b = xml.find("B", only_one=False)
+    all_b.clear()
+    assert len(xml.find("B", only_one=False)) == 2
+    assert xml.version == version
+
+    b.name = "X"
+    assert xml.version > version
+    assert xml.find("B").content == "bb"
+
+    version = xml.version
+    b.content = "c"
+    assert xml.version > version
+    assert xml.find("X", with_content="c") is b
+
+    version = xml.version
+    b.remove()
+    assert xml.version > version
+    assert xml.find("X") is None
+
+    version = xml.version
+    b.add_as_first_son_of(xml.tree)
+    assert xml.version > version
+    assert xml.find("X") is b
+
+    version = xml.version
+    b._sons[0].text = "d"
+    assert xml.version > version
+    assert xml.find(with_content="d") is b
+
+    version = xml.version
+    b.comment_out()
+    assert xml.version > version
+    version = xml.version
+    b.uncomment()
+    assert xml.version > version
+
+    # elements that are not a part of the document do not change it
+    b.remove()
+    version = xml.version
+    b.name = "Y"
+    Element("Z").add_as_last_son_of(b)
+    assert xml.version == version
+
+
+def test_name_summaries():
+    src = textwrap.dedent("""\
+        <root>
+            <A>
+                <B>b</B>
+                <!--comment-->
+            </A>
+            <C>
+                <D>d</D>
+            </C>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name, name_summaries=True)
+
+    a = xml.find("A")
+    c = xml.find("C")
+    assert xml.find("b", case_sensitive=False).content == "b"
+    assert xml.find("comment").parent is a
+    assert xml.find("D|E") is None
+    assert xml.find("X") is None
+
+    x = Element("X")
+    Element("Y").add_as_last_son_of(x)
+    x.add_as_last_son_of(c)
+    assert xml.find("Y").parent is x
+    assert xml.find("C|X|Y").parent is x
+
+    summary = xml.tree._summary
+    x.remove()
+    assert xml.tree._summary == summary  # the removed names are kept until the next search
+    assert xml.find("Y") is None
+    assert not xml._outdated_summaries
+    assert xml.tree._summary == _name_bit("root") | c._summary | a._summary
+    x.add_before(a)
+    assert xml.find("root|X|Y").parent is x
+
+    summary = xml.tree._summary
+    a.name = "E"
+    assert xml.tree._summary == summary | _name_bit("E")  # the bit of A stays, it is only a superset
+    assert a._summary & _name_bit("A")
+    assert xml.find("A") is None
+    assert xml.find("E") is a
+
+    xml.find("comment").text = "remark"
+    assert xml.find("comment") is None
+    assert xml.find("remark").parent is a
+    assert len(xml.find_many({"y": {"name": "Y", "only_one": False}})["y"]) == 1
+    _test_tree_integrity(xml)
+
+
+def test_document_order():
+    file_name = __create_file("<A><B><C/><D>d</D></B><E><F/></E></A>")
+    xml = SmartXML(file_name)
+
+    a = xml.tree
+    b = xml.find("B")
+    c = xml.find("C")
+    d = xml.find("D")
+    e = xml.find("E")
+    f = xml.find("F")
+
+    assert xml.is_ancestor_of(a, f)
+    assert xml.is_ancestor_of(b, d)
+    assert not xml.is_ancestor_of(b, f)
+    assert not xml.is_ancestor_of(d, b)
+    assert not xml.is_ancestor_of(d, d)
+
+    assert xml.compare_document_order(b, e) == -1
+    assert xml.compare_document_order(f, c) == 1
+    assert xml.compare_document_order(d, d) == 0
+
+    assert xml.sort_in_document_order([f, d, a, c, d]) == [a, c, d, d, f]
+    assert xml.sort_in_document_order([f, d, a, c, d], remove_duplicates=True) == [a, c, d, f]
+
+    # numbering follows modifications
+    e.add_as_first_son_of(a)
+    assert xml.sort_in_document_order([b, f, e]) == [e, f, b]
+    assert not xml.is_ancestor_of(b, a)
+
+    f.remove()
+    with pytest.raises(ValueError):
+        xml.compare_document_order(f, e)
+    with pytest.raises(ValueError):
+        xml.is_ancestor_of(a, Element("X"))
+
+
+def test_path_memo():
+    file_name = __create_file("<A><B><C><D/></C></B><E/></A>")
+    xml = SmartXML(file_name)
+
+    b = xml.find("B")
+    c = xml.find("C")
+    d = xml.find("D")
+    e = xml.find("E")
+    assert d.get_path() == "A|B|C|D"
+    assert d.get_depth() == 3
+    assert xml.tree.get_depth() == 0
+
+    # the path is memoized for the element and its parent, and the parent's path is reused by its sons
+    assert d._path == "A|B|C|D" and c._path == "A|B|C"
+    assert b._path is None
+    epoch = d._path_epoch
+    assert epoch.current and c._path_epoch is epoch
+    c._path = "memo|C"
+    assert c.get_path() == "memo|C"
+    Element("Z").add_as_first_son_of(c)  # a structure change outdates all the memos
+    assert not epoch.current
+    assert c.get_path() == "A|B|C"
+    c.find("Z").remove()
+
+    b.name = "X"
+    assert not c._path_epoch.current
+    assert d.get_path() == "A|X|C|D"
+    assert e.get_path() == "A|E"
+
+    c.add_as_last_son_of(e)
+    assert d.get_path() == "A|E|C|D"
+    assert d.get_depth() == 3
+
+    c.add_before(e)
+    assert d.get_path() == "A|C|D"
+    assert d.get_depth() == 2
+    assert b.get_path() == "A|X"
+
+    c.remove()
+    assert d.get_path() == "C|D"
+    assert d.get_depth() == 1
+
+    c.add_as_first_son_of(e)
+    c.name = "Y"
+    assert d.get_path() == "A|E|Y|D"
+    _test_tree_integrity(xml)
+
+    # the depth memos are kept per document
+    assert d.get_depth() == 3
+    epoch = d._position_epoch
+    other = SmartXML(__create_file("<A><B/></A>"))
+    other.find("B").remove()
+    assert d._position_epoch is epoch and epoch.current
+    Element("F").add_as_last_son_of(e)
+    assert not epoch.current
+    assert d.get_depth() == 3
+
+    # detached elements are not memoized
+    c.remove()
+    assert d.get_depth() == 1
+    assert d._position_epoch is None
+    assert d.get_path() == "Y|D"
+    assert not d._path_epoch.current
+
+
+def test_memos_of_moved_root():
+    a = SmartXML(__create_file("<A><B><C/></B></A>"))
+    b = SmartXML(__create_file("<X><Y/></X>"))
+    c = a.find("C")
+    y = b.find("Y")
+    assert c.get_depth() == 2
+    assert c.get_path() == "A|B|C"
+    version = a.version
+    y.comment_out()
+
+    a.tree.add_as_last_son_of(y)  # the root of a leaves its document
+    assert a.version != version
+    assert c.get_depth() == 4
+    assert c.get_path() == "X|Y|A|B|C"
+    with pytest.raises(IllegalOperation):
+        c.comment_out()
+
+    a = SmartXML(__create_file("<A><B><C/></B></A>"))
+    c = a.find("C")
+    assert c.get_depth() == 2
+    b.tree.insert_sons(0, [a.tree])
+    assert c.get_depth() == 3
+    assert c.get_path() == "X|A|B|C"
+
+
+def test_owner_is_kept():
+    def owners(element):
+        return {son._owner for son in element._iter_tree()}
+
+    a = SmartXML(__create_file("<A><B><C/><D/></B><E/></A>"))
+    x = SmartXML(__create_file("<X><Y/></X>"))
+    b = a.find("B")
+    y = x.find("Y")
+    assert owners(a.tree) == {a}
+
+    b.add_as_last_son_of(y)
+    assert owners(b) == {x}
+    b.remove()
+    assert owners(b) == {None}
+    b.add_as_first_son_of(a.tree)
+    assert owners(a.tree) == {a}
+
+    removed = b.remove_sons(lambda son: son.name == "C")
+    assert owners(removed[0]) == {None}
+    y.insert_sons(0, [b])
+    assert owners(b) == {x}
+    y.content = "text"
+    assert owners(y) == {x}
+    _test_tree_integrity(x)
+
+    with pytest.raises(RuntimeError):
+        with x.batch():
+            b.add_as_last_son_of(a.tree)
+            a.find("E").add_as_last_son_of(b)
+            raise RuntimeError()
+    assert owners(b) == {x}
+    assert owners(a.tree) == {a}
+    _test_tree_integrity(a)
+    _test_tree_integrity(x)
+
+    tree = a.tree
+    a.read(__create_file("<A/>"))
+    assert owners(tree) == {None}
+    assert owners(a.tree) == {a}
+
+    leaf = a.tree  # a change does not walk up to the root to find its document
+    for _ in range(5000):
+        Element("F").add_as_last_son_of(leaf)
+        leaf = leaf._sons[0]
+    assert leaf._owner is a
+    assert leaf.get_depth() == 5000
+
+
+def test_multi_line_content_is_one_node():
+    src = textwrap.dedent("""\
+        <root>
+        \t<a>line 1
+        \t\tline 2
+
+        \t\tline 3
+        \t\t<b/>
+        \t</a>
+        </root>
+        """)
+    dst = "<root>\n\t<a>first\n\t\tline 2\n\t\t\n\t\tline 3\n\t\t<b/>\n\t</a>\n</root>\n"
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+    a = xml.find("a")
+    assert len(a._sons) == 2
+    assert isinstance(a._sons[0], ContentOnly)
+    assert a.content == "line 1\nline 2\n\nline 3"
+
+    a.content = "first"
+    assert a.content == "first\nline 2\n\nline 3"
+    assert xml.to_string() == dst
+
+
+def test_content_memo():
+    file_name = __create_file("<A><B>one<C/>two</B></A>")
+    xml = SmartXML(file_name)
+    b = xml.find("B")
+    assert b.content == "one\ntwo"
+
+    b._sons[0].text = "1"
+    assert b.content == "1\ntwo"
+
+    three = ContentOnly("three")
+    three.add_as_last_son_of(b)
+    assert b.content == "1\ntwo\nthree"
+    assert xml.find(with_content="1\ntwo\nthree") is b
+
+    three.remove()
+    assert b.content == "1\ntwo"
+
+    b.content = "uno"
+    assert b.content == "uno\ntwo"
+
+    b._sons[0].remove()
+    b._sons[0].remove()
+    assert b.content == "two"
+    b.content = "dos"
+    assert b.content == "dos"
+
+
+def test_reference_source():
+    src = textwrap.dedent("""\
+        <root>
+        \t<a>  some text  </a>
+        \t<!-- a comment < -->
+        \t<b><![CDATA[<data>]]></b>
+        \t<c>one
+        \t\ttwo</c>
+        </root>
+        """)
+    dst = textwrap.dedent("""\
+        <root>
+        \t<a>some text</a>
+        \t<!-- a comment < -->
+        \t<b>
+        \t\t<![CDATA[<data>]]>
+        \t</b>
+        \t<c>one
+        \t\ttwo
+        \t</c>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name, reference_source=True)
+    assert xml.to_string() == dst
+    assert xml.to_string() == SmartXML(file_name).to_string()
+
+    a = xml.find("a")
+    assert a.content == "some text"
+    assert isinstance(a._sons[0], ContentOnly)
+    cdata = xml.find("b")._sons[0]
+    assert isinstance(cdata, CData)
+    assert cdata.text == "<data>"
+    comment = xml.tree._sons[1]
+    assert comment.text == " a comment < "
+
+    a.content = "new"
+    cdata.text = "[new data]"
+    comment.text = " new comment "
+    assert a.content == "new"
+    assert xml.find("new comment", case_sensitive=False) is None
+    assert xml.find(" new comment ") is comment
+    assert str(cdata) == "<![CDATA[[new data]]]>\n"
+
+
+def test_lazy_attributes():
+    src = textwrap.dedent("""\
+        <root>
+        \t<a id="1" name="x y"/>
+        \t<b   id = "2"   name="z"/>
+        \t<c/>
+        </root>
+        """)
+    dst = textwrap.dedent("""\
+        <root>
+        \t<a id="1" name="x y"/>
+        \t<b id="2" name="z" role="admin"/>
+        \t<c/>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+    a = xml.find("a")
+    b = xml.find("b")
+    c = xml.find("c")
+    assert a._attributes is None
+    assert c._attributes is None
+
+    b.attributes["role"] = "admin"
+    assert xml.to_string() == dst
+    assert a._attributes is None
+
+    assert a.attributes == {"id": "1", "name": "x y"}
+    assert c.attributes == {}
+    assert xml.to_string() == dst
+
+    a.attributes = {"id": "3"}
+    assert a.to_string() == '<a id="3"/>\n'
+
+    # a repeated attribute is written once, with its last value, as the attributes dict has it
+    file_name = __create_file('<root><a k="1" k="2"/><b k="1" j="k=1"/></root>')
+    xml = SmartXML(file_name)
+    result = xml.to_string()
+    assert result == '<root>\n\t<a k="2"/>\n\t<b k="1" j="k=1"/>\n</root>\n'
+    assert SmartXML(__create_file(result)).to_string() == result
+    assert xml.find("a").attributes == {"k": "2"}
+
+
+def test_gc_options():
+    file_name = __create_file("<A><B>b</B></A>")
+
+    assert gc.isenabled()
+    xml = SmartXML(file_name, pause_gc=True)
+    assert gc.isenabled()
+    assert xml.find("B").content == "b"
+
+    gc.disable()
+    SmartXML(file_name, pause_gc=True)
+    assert not gc.isenabled()
+    gc.enable()
+
+    with pytest.raises(BadXMLFormat):
+        SmartXML(__create_file("<A><B>b</A>"), pause_gc=True)
+    assert gc.isenabled()
+
+    file_name = __create_file("<A><B>b</B></A>")
+    frozen = gc.get_freeze_count()
+    xml = SmartXML(file_name, freeze_gc=True)
+    assert gc.get_freeze_count() > frozen
+    SmartXML.unfreeze_gc()
+    assert gc.get_freeze_count() == 0
+
+
+def test_clone():
+    src = textwrap.dedent("""\
+        <root>
+        \t<template id="1">first
+        \t\tsecond
+        \t\t<a x="1"/>
+        \t\t<!-- <b>bb</b> -->
+        \t\t<!--text-->
+        \t\t<c><![CDATA[data]]></c>
+        \t\t<d></d>
+        \t</template>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    for reference_source in (False, True):
+        xml = SmartXML(file_name, reference_source=reference_source)
+        template = xml.find("template")
+        template.attributes["id"] = "1"
+
+        copy = template.clone()
+        assert copy.parent is None
+        assert copy.to_string() == template.to_string()
+        assert copy.find("b").is_comment()
+        assert copy.find("a")._is_empty
+        assert not copy.find("d")._is_empty
+
+        copy.attributes["id"] = "2"
+        copy.find("a").attributes["x"] = "2"
+        copy.add_after(template)
+        assert template.attributes["id"] == "1"
+        assert template.find("a").attributes["x"] == "1"
+        assert len(xml.find("template", only_one=False)) == 2
+        assert copy.find("c")._sons[0].text == "data"
+        _test_tree_integrity(xml)
+
+
+def test_bulk_sons():
+    file_name = __create_file("<root><A><a1/><a2/><a3/></A><B>text</B><C/></root>")
+    xml = SmartXML(file_name)
+    a = xml.find("A")
+    b = xml.find("B")
+    c = xml.find("C")
+    c._is_empty = True
+
+    new_sons = [Element(f"n{index}") for index in range(3)]
+    c.extend_sons(new_sons)
+    assert not c._is_empty
+    assert [son.name for son in c._sons] == ["n0", "n1", "n2"]
+    assert all(son.parent is c for son in new_sons)
+
+    b.insert_sons(1, [a._sons[0], a._sons[2], c._sons[1]])
+    assert [son.name for son in a._sons] == ["a2"]
+    assert [son.name for son in c._sons] == ["n0", "n2"]
+    assert [repr(son) for son in b._sons] == ["text", "a1", "a3", "n1"]
+    assert b.content == "text"
+    assert xml.find("B|n1").parent is b
+
+    # moving sons within the same parent
+    b.insert_sons(0, [b._sons[3], b._sons[2]])
+    assert [repr(son) for son in b._sons] == ["n1", "a3", "text", "a1"]
+    _test_tree_integrity(xml)
+
+    with pytest.raises(ValueError):
+        a.extend_sons([c, c])
+
+    removed = b.remove_sons(lambda son: son.name.startswith("a"))
+    assert [son.name for son in removed] == ["a3", "a1"]
+    assert all(son.parent is None for son in removed)
+    assert [repr(son) for son in b._sons] == ["n1", "text"]
+    assert xml.find("a3") is None
+    assert b.remove_sons(lambda son: False) == []
+    _test_tree_integrity(xml)
+
+    # elements that are not Element have no self-closing flag to clear
+    for parent in (CData("data"), TextOnlyComment("note")):
+        son = Element("son")
+        son.add_as_last_son_of(parent)
+        assert son.parent is parent
+
+
+def test_comment_counters():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A>
+        \t\t<B><!-- text --></B>
+        \t\t<C><D/></C>
+        \t</A>
+        \t<!-- <E><F/></E> -->
+        </root>
+        """)
+
+    def check_counters(element):
+        comments = 0
+        for son in element._sons:
+            comments += check_counters(son) + son.is_comment()
+        assert element._comments_below == comments
+        return comments
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+    a = xml.find("A")
+    b = xml.find("B")
+    c = xml.find("C")
+    d = xml.find("D")
+    e = xml.find("E")
+    check_counters(xml.tree)
+    assert xml.tree._comments_below == 2
+
+    with pytest.raises(IllegalOperation):
+        a.comment_out()
+    with pytest.raises(IllegalOperation):
+        xml.find("F").comment_out()
+
+    c.comment_out()
+    check_counters(xml.tree)
+    with pytest.raises(IllegalOperation):
+        d.comment_out()
+
+    b._sons[0].remove()
+    check_counters(xml.tree)
+    c.uncomment()
+    a.comment_out()
+    check_counters(xml.tree)
+    with pytest.raises(IllegalOperation):
+        d.comment_out()
+
+    a.uncomment()
+    d.add_as_last_son_of(e)
+    with pytest.raises(IllegalOperation):
+        d.comment_out()
+    d.add_as_last_son_of(a)
+    d.comment_out()
+    check_counters(xml.tree)
+
+    a.extend_sons([e, TextOnlyComment("note")])
+    check_counters(xml.tree)
+    a.remove_sons(lambda son: son.is_comment())
+    check_counters(xml.tree)
+    a.comment_out()
+    check_counters(xml.tree)
+    assert a.clone()._comments_below == a._comments_below
+
+
+def test_batch():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A id="1">text</A>
+        \t<B>
+        \t\t<C/>
+        \t\t<!-- <D/> -->
+        \t</B>
+        \t<E/>
+        </root>
+        """)
+
+    def check_derived(element, renamed=False):
+        comments = 0
+        summary = _name_bit(element._name_for_match())
+        for son in element._sons:
+            comments += check_derived(son, renamed) + son.is_comment()
+            summary |= son._summary
+        assert element._comments_below == comments
+        if renamed:  # the bits of the old names stay
+            assert element._summary & summary == summary
+        else:
+            assert element._summary == summary
+        return comments
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name, name_summaries=True)
+    a = xml.find("A")
+    b = xml.find("B")
+    c = xml.find("C")
+    e = xml.find("E")
+
+    version = xml.version
+    with xml.batch():
+        a.name = "A1"
+        a.attributes["id"] = "2"
+        c.add_as_last_son_of(e)
+        assert xml.find("E|C") is c
+        assert c.get_path() == "root|E|C"
+        f = Element("F")
+        f.add_as_first_son_of(b)
+        assert xml.find("F") is f
+        b.remove_sons(lambda son: son.is_comment())
+        assert xml.version == version
+    assert xml.version > version
+    check_derived(xml.tree)
+    assert xml.find("A1") is a
+    assert xml.find("D") is None
+
+    result = xml.to_string()
+    version = xml.version
+    with pytest.raises(KeyError):
+        with xml.batch():
+            a.name = "A2"
+            a.attributes["id"] = "3"
+            a.content = "new text"
+            e.comment_out()
+            f.remove()
+            Element("G").add_as_last_son_of(c)
+            with xml.batch():
+                c.add_as_last_son_of(b)
+            raise KeyError("rollback")
+    assert xml.to_string() == result
+    assert xml.version > version
+    check_derived(xml.tree)
+    assert c.parent is e
+    assert f.parent is b
+    assert a.attributes == {"id": "2"}
+    assert not e.is_comment()
+    assert xml.find("A2") is None
+
+    assert a.content == "text"
+    with pytest.raises(KeyError):
+        with xml.batch():
+            a._sons[0].text = "changed"
+            assert a.content == "changed"
+            raise KeyError("rollback")
+    assert a._sons[0].text == "text"
+    assert a.content == "text"
+    assert xml.find(with_content="text") is a
+    assert xml.find(with_content="changed") is None
+
+    # a batch records only its own tree, the other trees are changed, and searched, as usual
+    other = SmartXML(__create_file("<root><X><Y/></X><Z/></root>"), name_summaries=True, find_cache_size=8)
+    x = other.find("X")
+    y = other.find("Y")
+    result = xml.to_string()
+    with pytest.raises(KeyError):
+        with xml.batch():
+            x.name = "X1"
+            assert other.find("X1") is x
+            assert other.find("X1") is x  # from the cache
+            assert other.tree._summary & _name_bit("X1")
+            y.add_as_last_son_of(a)  # moved into the batch
+            b.add_as_last_son_of(other.find("Z"))  # moved out of the batch
+            b.name = "B1"
+            raise KeyError("rollback")
+    assert xml.to_string() == result
+    assert other.to_string() == "<root>\n\t<X1></X1>\n\t<Z></Z>\n</root>\n"
+    assert y.parent is None
+    assert b.parent is xml.tree and b.name == "B"
+    check_derived(xml.tree)
+    check_derived(other.tree, renamed=True)
+
+
+def test_events():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A id="1">text</A>
+        \t<B>
+        \t\t<C/>
+        \t\t<!--note-->
+        \t</B>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+    a = xml.find("A")
+    b = xml.find("B")
+    c = xml.find("C")
+    events = []
+
+    def on_change(event):
+        events.append((event.event_type, event.element, event.parent, event.old, event.new))
+
+    a.name = "A0"
+    xml.subscribe(on_change)
+
+    a.name = "A1"
+    assert events.pop() == (EventType.rename, a, None, "A0", "A1")
+    a.content = "new text"
+    assert events.pop() == (EventType.content_change, a._sons[0], None, "text", "new text")
+    a.attributes = {"id": "2"}
+    assert events.pop() == (EventType.attribute_change, a, None, {"id": "1"}, {"id": "2"})
+    c.add_as_last_son_of(a)
+    assert events == [(EventType.remove, c, b, None, None), (EventType.insert, c, a, None, None)]
+    events.clear()
+    b._sons[0].text = "other"
+    assert events.pop() == (EventType.content_change, b._sons[0], None, "note", "other")
+    c.comment_out()
+    c.uncomment()
+    assert events == [(EventType.comment_out, c, None, None, None), (EventType.uncomment, c, None, None, None)]
+    events.clear()
+
+    removed = b.remove_sons(lambda son: True)
+    assert events == [(EventType.remove, removed[0], b, None, None)]
+    events.clear()
+
+    with pytest.raises(KeyError):
+        with xml.batch():
+            c.name = "C1"
+            raise KeyError("rollback")
+    assert events == []
+    with xml.batch():
+        c.name = "C1"
+        assert events == []
+    assert events.pop() == (EventType.rename, c, None, "C", "C1")
+
+    c.remove()
+    events.clear()
+    c.name = "C2"  # not a part of the tree anymore
+    xml.unsubscribe(on_change)
+    a.name = "A2"
+    assert events == []
+    with pytest.raises(ValueError):
+        xml.unsubscribe(on_change)
+
+    # a document dropped with subscribers stops slowing the changes of the other documents down
+    observed = ElementBase._observed
+    xml.subscribe(on_change)
+    xml.subscribe(print)
+    assert ElementBase._observed == observed + 1
+    del xml, a, b, c, removed
+    gc.collect()
+    assert ElementBase._observed == observed
+
+
+def test_profiling():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A>text</A>
+        \t<!-- <B/> -->
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    find = SmartXML.find
+    profiling.timing_registry.clear()
+    profiling.enable()
+    try:
+        assert profiling.is_enabled()
+        xml = SmartXML(file_name)
+        assert xml.find("A").content == "text"
+        xml.find_many({"b": "B"})
+        xml.write()
+        with pytest.raises(BadXMLFormat):
+            SmartXML()._read_xml("<root>")
+    finally:
+        profiling.disable()
+    assert not profiling.is_enabled()
+    assert SmartXML.find is find
+
+    stats = profiling.timing_registry.stats()
+    assert stats["read"]["calls"] == 2
+    assert stats["tokenize"]["calls"] == 3
+    assert stats["comment_reparse"]["calls"] == 1
+    assert stats["find"]["calls"] == 2
+    assert stats["write"]["calls"] == 1
+    assert stats["tokenize"]["total"] <= stats["read"]["total"]
+    assert stats["build"]["calls"] == 2
+    assert 0 < stats["build"]["total"] < stats["read"]["total"]
+    parts = stats["build"]["total"] + stats["tokenize"]["total"] + stats["comment_reparse"]["total"]
+    assert parts >= stats["read"]["total"]  # the tokens of the comment are in both tokenize and comment_reparse
+
+    document_stats = profiling.timing_registry.document_stats()
+    assert document_stats[str(file_name)]["find"]["calls"] == 2
+    assert document_stats[str(file_name)]["comment_reparse"]["calls"] == 1
+
+    xml.find("A")
+    assert profiling.timing_registry.stats()["find"]["calls"] == 2
+    profiling.timing_registry.clear()
+
+
+def test_memory_stats():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A id="1">text</A>
+        \t<A>text</A>
+        \t<!-- note -->
+        \t<!-- <B/> -->
+        \t<![CDATA[data]]>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+    stats = xml.memory_stats()
+    assert stats["nodes"] == {"Element": 3, "ContentOnly": 2, "TextOnlyComment": 1, "Comment": 1, "CData": 1}
+    assert stats["total_bytes"] == sum(
+        stats[key] for key in ["nodes_bytes", "names_bytes", "attributes_bytes", "text_bytes", "caches_bytes"]
+    )
+    assert 0 <= stats["sons_over_allocation_bytes"] < stats["nodes_bytes"]
+    assert "read_peak_bytes" not in stats
+
+    names_bytes = stats["names_bytes"]
+    xml.find("A").attributes
+    xml.find("B").name = "A"  # the same name string is counted once
+    xml.find(with_content="text")
+    stats = xml.memory_stats()
+    assert stats["names_bytes"] < names_bytes
+    assert stats["caches_bytes"] == 0  # the content of a single text son is that text, counted under text_bytes
+
+    xml = SmartXML(__create_file("<root><A>text<x/>more</A></root>"))
+    text_bytes = xml.memory_stats()["text_bytes"]
+    assert xml.find("A").content == "text\nmore"
+    stats = xml.memory_stats()
+    assert stats["text_bytes"] == text_bytes
+    assert stats["caches_bytes"] > 0
+
+    xml = SmartXML(file_name, trace_memory=True)
+    stats = xml.memory_stats()
+    assert 0 < stats["read_allocated_bytes"] <= stats["read_peak_bytes"]
+
+
+def test_parse_stats():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A id="1">טקסט</A>
+        \t<B>
+        \t\t<C/>
+        \t\t<D/>
+        \t\t<E/>
+        \t</B>
+        \t<!-- note -->
+        \t<!-- <F/> -->
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    assert SmartXML(file_name).parse_stats is None
+
+    xml = SmartXML(file_name, parse_stats=True)
+    stats = xml.parse_stats
+    assert stats.bytes == len(src.encode("utf-8"))
+    assert stats.tokens == 12
+    assert stats.elements == {"Element": 6, "ContentOnly": 1, "TextOnlyComment": 1, "Comment": 1}
+    assert stats.max_depth == 2
+    assert stats.max_fan_out == 4
+    assert stats.comments_reparsed == 1
+    assert set(stats.seconds) == {"tokenize", "build", "total"}
+    assert stats.as_dict()["mb_per_second"]["total"] > 0
+
+
+def test_limits(monkeypatch):
+    src = textwrap.dedent("""\
+        <root>
+        \t<A id="1" kind="x">some text</A>
+        \t<B>
+        \t\t<C><D/></C>
+        \t</B>
+        \t<!-- note -->
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    fitting = Limits(
+        max_bytes=len(src), max_nodes=7, max_depth=4, max_attributes=2, max_text_length=9, time_limit=10
+    )
+    assert SmartXML(file_name, limits=fitting).find("D") is not None
+
+    for limits, message in [
+        (Limits(max_bytes=len(src) - 1), "max_bytes"),
+        (Limits(max_nodes=6), "max_nodes"),
+        (Limits(max_depth=3), r"max_depth \(3\) in line 4"),
+        (Limits(max_attributes=1), r"max_attributes \(1\) in line 2"),
+        (Limits(max_text_length=8), r"max_text_length \(8\) in line 2"),
+        (Limits(time_limit=0), "time_limit"),
+    ]:
+        with pytest.raises(LimitExceeded, match=message):
+            SmartXML(file_name, limits=limits)
+
+    xml = SmartXML(limits=Limits(max_bytes=10))
+    with pytest.raises(BadXMLFormat, match="max_bytes"):
+        xml._read_xml("<root>טקסט</root>")
+
+    # elements inside comments are read too
+    many = "<root><!-- " + "<b/>" * 20_000 + " --></root>"
+    with pytest.raises(LimitExceeded, match="max_nodes"):
+        SmartXML(limits=Limits(max_nodes=1000))._read_xml(many)
+    deep = "<root><A><!-- " + "<a>" * 5000 + "</a>" * 5000 + " --></A></root>"
+    with pytest.raises(LimitExceeded, match="max_depth"):
+        SmartXML(limits=Limits(max_depth=10))._read_xml(deep)
+    nested = "<root><A><!-- <a><b/></a> --></A></root>"
+    SmartXML(limits=Limits(max_depth=4, max_nodes=5))._read_xml(nested)
+    with pytest.raises(LimitExceeded, match=r"max_depth \(3\)"):
+        SmartXML(limits=Limits(max_depth=3))._read_xml(nested)
+    with pytest.raises(LimitExceeded, match=r"max_nodes \(4\)"):
+        SmartXML(limits=Limits(max_nodes=4))._read_xml(nested)
+
+    # the time limit is checked inside comments too, the clock passes the deadline after the first check
+    clock = iter([0.0, 0.0])
+    monkeypatch.setattr(time, "monotonic", lambda: next(clock, 100.0))
+    check = _LimitsCheck(Limits(time_limit=0.01))
+    with pytest.raises(LimitExceeded, match="time_limit"):
+        _read_elements("<root><!-- " + "<b/>" * 200_000 + " --></root>", False, None, check, None)
+    monkeypatch.undo()
+    assert 1000 < check.nodes <= _LimitsCheck._CHECK_TIME_EVERY + 2  # stopped at the second check, in the comment
+    # a comment that is not elements counts as a single node
+    SmartXML(limits=Limits(max_nodes=4))._read_xml("<root><!-- <a><b> --><c/></root>")
+
+
+def test_progress_and_cancel():
+    src = '<?xml version="1.0"?>\n<root>\n' + "".join(f"\t<item id=\"{i}\">טקסט {i}</item>\n" for i in range(2000)) + "</root>\n"
+    file_name = __create_file(src)
+    size = file_name.stat().st_size
+
+    calls = []
+    xml = SmartXML()
+    xml.read(file_name, progress=lambda done, total: calls.append((done, total)), progress_step=10_000)
+    assert len(calls) > size // 10_000
+    assert all(total == size for _, total in calls)
+    assert [done for done, _ in calls] == sorted(done for done, _ in calls)
+    assert calls[-1] == (size, size)
+    assert len(xml.find("item", only_one=False)) == 2000
+
+    calls.clear()
+    xml.write(file_name, progress=lambda done, total: calls.append((done, total)), progress_step=10_000)
+    assert calls[-1] == (size, size)
+    assert file_name.read_text() == src
+
+    token = CancellationToken()
+
+    def cancel_halfway(done, total):
+        if done > total // 2:
+            token.cancel()
+
+    with pytest.raises(OperationCancelled):
+        SmartXML().read(file_name, progress=cancel_halfway, cancel_token=token, progress_step=1000)
+
+    xml.find("item").content = "changed"
+    with pytest.raises(OperationCancelled):
+        xml.write(file_name, cancel_token=token)
+    assert file_name.read_text() == src
+    assert not file_name.with_name(file_name.name + ".tmp").exists()
+
+    token = CancellationToken()
+    with pytest.raises(OperationCancelled):
+        xml.write(file_name, progress=cancel_halfway, cancel_token=token, progress_step=1000)
+    assert file_name.read_text() == src
+    assert not file_name.with_name(file_name.name + ".tmp").exists()
+
+    # a failed write, without progress or cancel_token, leaves no temporary file either
+    xml.find("item").content = "\ud800"  # can not be encoded
+    with pytest.raises(UnicodeEncodeError):
+        xml.write(file_name)
+    assert file_name.read_text() == src
+    assert not file_name.with_name(file_name.name + ".tmp").exists()
+
+
+def test_find_in_file():
+    src = textwrap.dedent("""\
+        <?xml version="1.0"?>
+        <root>
+        \t<item id="1">
+        \t\t<name>one</name>
+        \t</item>
+        \t<!-- <item id="2"><name>two</name></item> -->
+        \t<group>
+        \t\t<item id="3">
+        \t\t\t<name>Three</name>
+        \t\t\t<sub/>
+        \t\t</item>
+        \t</group>
+        \t<item id="4"/>
+        </root>
+        """)
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+
+    for name, content, case_sensitive in [
+        ("item", None, True),
+        ("name", "three", False),
+        ("name", "three", True),
+        ("item|name", None, True),
+        ("group|item|sub", None, True),
+        ("", "two", True),
+        ("missing", None, True),
+    ]:
+        first = smartXML.find_in_file(file_name, name, True, content, case_sensitive)
+        expected = xml.find(name, True, content, case_sensitive)
+        assert (first and first.to_string()) == (expected and expected.to_string())
+        found = smartXML.find_in_file(file_name, name, False, content, case_sensitive)
+        expected = xml.find(name, False, content, case_sensitive)
+        assert [element.to_string() for element in found] == [element.to_string() for element in expected]
+
+    item = smartXML.find_in_file(file_name, "item", with_content=None)
+    assert item.attributes == {"id": "1"}
+    assert item.find("name").content == "one"
+
+    # the part after the match is not read
+    file_name = __create_file("<root><item/><broken></root>")
+    assert smartXML.find_in_file(file_name, "item") is not None
+    with pytest.raises(BadXMLFormat):
+        smartXML.find_in_file(file_name, "missing")
+    with pytest.raises(ValueError):
+        smartXML.find_in_file(file_name)
+
+    # a big file is searched with the garbage collector paused, but not while the caller handles the results
+    file_name = __create_file("<root>" + "<item><name>n</name></item>" * 40000 + "</root>")
+    found = smartXML.find_in_file(file_name, "name", only_one=False)
+    count = 0
+    for element in found:
+        assert gc.isenabled()
+        count += 1
+    assert count == 40000 and gc.isenabled()
+
+
+def test_explain():
+    src = textwrap.dedent("""\
+        <root>
+        \t<A><C>one</C></A>
+        \t<B><C>two</C></B>
+        \t<D/>
+        </root>
+        """)
+
+    file_name = __create_file(src)
+    xml = SmartXML(file_name)
+    check_name_match = Element._check_name_match
+
+    report = xml.explain("C", only_one=False)
+    assert report["strategy"] == ["full traversal"]
+    assert report["nodes_visited"] == 8
+    assert report["name_comparisons"] > 0
+    assert report["content_evaluations"] == 0
+    assert report["results"] == 2
+    assert Element._check_name_match is check_name_match
+
+    report = xml.explain("B|C", with_content="two")
+    assert report["content_evaluations"] > 0
+    assert report["results"] == 1
+    assert "match the path from its first name, 'B'" in report["strategy"]
+
+    xml.find("D")
+    assert "find() would return the cached result" in xml.explain("D")["strategy"]
+    assert xml.explain("missing")["results"] == 0
+
+    xml = SmartXML(file_name, name_summaries=True)
+    report = xml.explain("D")
+    assert "skip subtrees by names summaries" in report["strategy"]
+    assert report["nodes_visited"] < 8
+
+    with pytest.raises(ValueError):
+        xml.explain()
+
+    profiling.query_counters.clear()
+    profiling.enable_query_counters()
+    try:
+        xml.find("C", only_one=False)
+        xml.find_many({"a": "A", "d": "D"})
+        assert xml.explain("D")["nodes_visited"] > 0
+    finally:
+        profiling.disable_query_counters()
+    counters = profiling.query_counters.as_dict()
+    assert counters["queries"] == 3
+    assert counters["nodes_visited"] > 0
+    assert Element._check_name_match is check_name_match
+    profiling.query_counters.clear()
+
+
 def print_green(message: str) -> None:
     print(f"\033[32m{message}\033[0m")
 
@@ -0,0 +1,40 @@
+import time
+import tracemalloc
+
+import pytest
+
+from pathological_corpus import CASES
+
+
+def _best_time(case, text: str) -> float:
+    times = []
+    for _ in range(3):
+        start_time = time.perf_counter()
+        case.work(text)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_pathological_time(name):
+    case = CASES[name]
+    small_time = _best_time(case, case.build(case.size))
+    big_time = _best_time(case, case.build(case.size * 4))
+
+    # linear work takes about 4 times longer, quadratic work about 16 times
+    assert big_time < small_time * 8, f"{name}: {small_time:.4f}s -> {big_time:.4f}s"
+    assert big_time < case.seconds, f"{name}: {big_time:.4f}s"
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_pathological_memory(name):
+    case = CASES[name]
+    text = case.build(case.size * 4)
+    tracemalloc.start()
+    try:
+        case.work(text)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert peak < case.bytes_per_character * len(text), f"{name}: {peak / len(text):.1f} bytes per character"